@@ -0,0 +1,236 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from html import escape
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from bot.classifiers import (
+    PM_LEVELS, UV_LEVELS, WEATHER_CONDITIONS, MISSING, classify_measurements, band_labels,
+)
+
+load_dotenv()
+
+ALERTS_DB_PATH = os.getenv('ALERTS_DB_PATH', 'bot_alerts.sqlite3')
+ALERTS_LOCK_PATH = os.getenv('ALERTS_LOCK_PATH', ALERTS_DB_PATH + '.lock')
+
+# evaluate(bands) takes classify_measurements() of several devices and returns
+# each one's alarming band, or None when its reading is fine or missing.
+# Consecutive measurements in the same band notify nobody.
+AlertRule = namedtuple('AlertRule', ['key', 'command', 'title', 'description', 'evaluate'])
+
+UNHEALTHY_PM_BAND = PM_LEVELS.index("Unhealthy 🟠")
+HIGH_UV_BAND = UV_LEVELS.index("Very High 🔴")
+SNOW_CONDITION = WEATHER_CONDITIONS.index("Possibly Snowing ❄️")
+
+
+def unhealthy_pm2_5(bands):
+    return band_labels(np.where(bands.pm2_5 >= UNHEALTHY_PM_BAND, bands.pm2_5, MISSING), PM_LEVELS, None)
+
+
+def high_uv(bands):
+    return band_labels(np.where(bands.uv >= HIGH_UV_BAND, bands.uv, MISSING), UV_LEVELS, None)
+
+
+def snowing(bands):
+    return band_labels(np.where(bands.weather == SNOW_CONDITION, bands.weather, MISSING), WEATHER_CONDITIONS, None)
+
+
+ALERT_RULES = {
+    rule.key: rule for rule in (
+        AlertRule('pm2_5', 'Alert_air', 'PM2.5', 'PM2.5 reaches Unhealthy', unhealthy_pm2_5),
+        AlertRule('uv', 'Alert_uv', 'UV Index', 'UV Index reaches Very High', high_uv),
+        AlertRule('snow', 'Alert_snow', 'Snow', 'Possible snowfall', snowing),
+    )
+}
+ALERT_COMMANDS = {rule.command: rule for rule in ALERT_RULES.values()}
+
+
+class AlertSubscriptions:
+    # The whole table is mirrored in memory as device -> rule -> chats, which
+    # is the direction the engine reads it in; SQLite only makes it survive
+    # restarts. Other processes share the file, so the mirror is reloaded
+    # when SQLite reports that another connection has committed. The file is
+    # opened on first use, so importing the views creates nothing.
+    def __init__(self, path=ALERTS_DB_PATH):
+        self.path = path
+        self._by_device = {}
+        self._by_chat = {}
+        self._version = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Called with the lock held.
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS alert_subscriptions ('
+                'chat_id INTEGER NOT NULL, device_id TEXT NOT NULL, rule TEXT NOT NULL, '
+                'PRIMARY KEY (chat_id, device_id, rule))'
+            )
+            self._connection = connection
+        return self._connection
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        # Called with the lock held.
+        connection = self._connect()
+        version = connection.execute('PRAGMA data_version').fetchone()[0]
+        if version == self._version:
+            return
+        self._by_device, self._by_chat = {}, {}
+        for chat_id, device_id, rule in connection.execute('SELECT chat_id, device_id, rule FROM alert_subscriptions'):
+            self._index(chat_id, device_id, rule)
+        self._version = version
+
+    def _index(self, chat_id, device_id, rule):
+        self._by_device.setdefault(device_id, {}).setdefault(rule, set()).add(chat_id)
+        self._by_chat.setdefault(chat_id, set()).add((device_id, rule))
+
+    def add(self, chat_id, device_id, rule):
+        with self._lock:
+            self._refresh()
+            self._connection.execute(
+                'INSERT OR IGNORE INTO alert_subscriptions (chat_id, device_id, rule) VALUES (?, ?, ?)',
+                (chat_id, device_id, rule),
+            )
+            self._index(chat_id, device_id, rule)
+
+    def remove(self, chat_id, device_id, rule):
+        with self._lock:
+            self._refresh()
+            self._connection.execute(
+                'DELETE FROM alert_subscriptions WHERE chat_id = ? AND device_id = ? AND rule = ?',
+                (chat_id, device_id, rule),
+            )
+            rules = self._by_device.get(device_id, {})
+            chats = rules.get(rule)
+            if chats is not None:
+                chats.discard(chat_id)
+                if not chats:
+                    del rules[rule]
+                if not rules:
+                    self._by_device.pop(device_id, None)
+            subscriptions = self._by_chat.get(chat_id)
+            if subscriptions is not None:
+                subscriptions.discard((device_id, rule))
+                if not subscriptions:
+                    del self._by_chat[chat_id]
+
+    def toggle(self, chat_id, device_id, rule):
+        if self.subscribed(chat_id, device_id, rule):
+            self.remove(chat_id, device_id, rule)
+            return False
+        self.add(chat_id, device_id, rule)
+        return True
+
+    def subscribed(self, chat_id, device_id, rule):
+        with self._lock:
+            self._refresh()
+            return (device_id, rule) in self._by_chat.get(chat_id, ())
+
+    def for_chat(self, chat_id):
+        with self._lock:
+            self._refresh()
+            return sorted(self._by_chat.get(chat_id, ()))
+
+    def watched(self, device_id):
+        # {rule: chat ids} for one device, copied so fan-out can run without
+        # the lock. The engine refreshes once per cycle before calling this.
+        with self._lock:
+            return {rule: tuple(chats) for rule, chats in self._by_device.get(device_id, {}).items()}
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return sum(len(subscriptions) for subscriptions in self._by_chat.values())
+
+
+class ProcessLease:
+    # Held by at most one process at a time through an exclusive lock on a
+    # file; the OS releases it when the holder exits, and the next process to
+    # ask takes it over. Without fcntl every process holds it.
+    def __init__(self, path=ALERTS_LOCK_PATH):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def held(self):
+        with self._lock:
+            if self._file is not None or fcntl is None:
+                return True
+            lease = open(self.path, 'a')
+            try:
+                fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lease.close()
+                return False
+            self._file = lease
+            return True
+
+
+class AlertEngine:
+    # Runs once per published snapshot. The watched devices with a new
+    # measurement are classified together, each rule runs once over all of
+    # them, and the one rendered message is handed to broadcast() with every
+    # subscribed chat. When several web processes share the subscriptions,
+    # all of them keep the band state but only the holder of the lease
+    # notifies, so nobody gets the same alert twice.
+    def __init__(self, subscriptions, broadcast, device_name, rules=ALERT_RULES, lease=None):
+        self.subscriptions = subscriptions
+        self.broadcast = broadcast
+        self.device_name = device_name
+        self.rules = rules
+        self.lease = lease
+        self.evaluations = 0
+        self.notifications = 0
+        self._bands = {}
+
+    def on_measurements(self, measurements):
+        self.subscriptions.refresh()
+        notify = self.lease is None or self.lease.held()
+        watched = {device_id: self.subscriptions.watched(device_id) for device_id in measurements}
+        watched = {device_id: rules for device_id, rules in watched.items() if rules}
+        if not watched:
+            return
+        bands = classify_measurements([measurements[device_id] for device_id in watched])
+        evaluated = {}
+        for i, (device_id, rules) in enumerate(watched.items()):
+            measurement = measurements[device_id]
+            for key, chat_ids in rules.items():
+                rule = self.rules.get(key)
+                if rule is None:
+                    continue
+                if key not in evaluated:
+                    evaluated[key] = rule.evaluate(bands)
+                band = evaluated[key][i]
+                self.evaluations += 1
+                state_key = (device_id, key)
+                known = state_key in self._bands
+                previous = self._bands.get(state_key)
+                self._bands[state_key] = band
+                # The first reading after start-up only sets the baseline, so a
+                # restart does not repeat alerts that were already sent.
+                if not known or band == previous or not notify:
+                    continue
+                self.notifications += self.broadcast(chat_ids, self.format(device_id, rule, band, measurement))
+
+    def band(self, device_id, key):
+        return self._bands.get((device_id, key))
+
+    def format(self, device_id, rule, band, measurement):
+        device = escape(self.device_name(device_id))
+        if band is None:
+            return f"✅ <b>{device}</b>: {rule.title} is back to normal.\n🔹 <b>Timestamp:</b> {measurement.get('timestamp')}"
+        return f"🚨 <b>{device}</b>: {rule.title} alert, {band}\n🔹 <b>Timestamp:</b> {measurement.get('timestamp')}"
@@ -0,0 +1,124 @@
+import asyncio
+import functools
+import inspect
+
+import aiohttp
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from bot.async_upstream import async_climatenet_client, CircuitOpenError
+from bot.views import (
+    TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL, HANDLERS, advance, measurement_cache, measurement_snapshot,
+    parse_latest_measurement, record_history, device_health, get_last_known, metrics, command_logger,
+    write_buffer, INLINE_CACHE_SECONDS, get_inline_results, MALFORMED_ERRORS,
+)
+
+if TELEGRAM_API_URL:
+    asyncio_helper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+
+async_bot = AsyncTeleBot(TELEGRAM_BOT_TOKEN)
+in_flight = {}
+metrics.register('async_upstream', async_climatenet_client.latency_stats, label='endpoint')
+metrics.register('async_in_flight', lambda: {'requests': len(in_flight)})
+
+
+def logged(body):
+    log_command = command_logger(body.__name__)
+
+    @functools.wraps(body)
+    async def wrapper(message):
+        write_buffer.submit(log_command, message)
+        with metrics.track(body.__name__):
+            await run_handler(body, message)
+    return wrapper
+
+
+async def request_latest_measurement(device_id):
+    try:
+        status, data = await async_climatenet_client.get_json(f"/device_inner/{device_id}/latest/", endpoint="latest")
+    except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError) as e:
+        print(f"Error fetching measurement for {device_id}: {e}")
+        return None
+    except ValueError as e:
+        device_health.record(device_id, 200, None)
+        print(f"Malformed measurement for {device_id}: {e!r}")
+        return None
+    if status != 200:
+        device_health.record(device_id, status, None)
+        print(f"Failed to fetch data: {status}")
+        return None
+    try:
+        measurement = parse_latest_measurement(data)
+    except MALFORMED_ERRORS as e:
+        device_health.record(device_id, status, None)
+        print(f"Malformed measurement for {device_id}: {e!r}")
+        return None
+    device_health.record(device_id, status, data)
+    await asyncio.to_thread(record_history, device_id, data)
+    if measurement is not None:
+        measurement_cache.put(device_id, measurement)
+    return measurement
+
+
+def start_fetch(device_id):
+    task = in_flight.get(device_id)
+    if task is None:
+        task = in_flight[device_id] = asyncio.ensure_future(request_latest_measurement(device_id))
+        task.add_done_callback(lambda _: in_flight.pop(device_id, None))
+    return task
+
+
+async def fetch_latest_measurement(device_id):
+    measurement = measurement_cache.lookup(device_id)
+    if measurement is not None:
+        return measurement
+    return await asyncio.shield(start_fetch(device_id))
+
+
+async def get_measurements(device_id_list):
+    measurements = [measurement_snapshot.current(device_id) for device_id in device_id_list]
+    missing = [i for i, measurement in enumerate(measurements) if measurement is None]
+    if async_climatenet_client.available('latest'):
+        fetched = await asyncio.gather(*(fetch_latest_measurement(device_id_list[i]) for i in missing))
+    else:
+        # Serve the last known readings and let the in-flight fetches refresh them.
+        fetched = [None] * len(missing)
+        for i in missing:
+            start_fetch(device_id_list[i])
+    for i, measurement in zip(missing, fetched):
+        measurements[i] = measurement or get_last_known(device_id_list[i])[0]
+    return measurements
+
+
+async def run_handler(body, message):
+    # The body's steps touch the session and alert stores, which may block,
+    # so they run on worker threads; only the fetches between them run here.
+    steps = await asyncio.to_thread(body, message)
+    if inspect.isgenerator(steps):
+        device_id_list = await asyncio.to_thread(advance, steps)
+        while device_id_list is not None:
+            measurements = await get_measurements(device_id_list)
+            device_id_list = await asyncio.to_thread(advance, steps, measurements)
+
+
+for filters, body in HANDLERS:
+    async_bot.message_handler(**filters)(logged(body))
+
+
+@async_bot.inline_handler(func=lambda query: True)
+async def handle_inline_query(query):
+    with metrics.track('handle_inline_query'):
+        await async_bot.answer_inline_query(query.id, get_inline_results(query.query), cache_time=INLINE_CACHE_SECONDS)
+
+
+async def main():
+    await async_bot.remove_webhook()
+    try:
+        await async_bot.infinity_polling()
+    finally:
+        await async_climatenet_client.close()
+        await async_bot.close_session()
+
+
+def run_async_bot():
+    asyncio.run(main())
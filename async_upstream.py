@@ -0,0 +1,85 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+
+from bot.upstream import (
+    CLIMATENET_BASE_URL, UPSTREAM_POOL_SIZE, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT,
+    UPSTREAM_RETRIES, UPSTREAM_BACKOFF, RETRY_STATUSES, RetryBudget, LatencyRecorder, CircuitBreakers,
+    CircuitOpenError, climatenet_client,
+)
+
+
+class AsyncUpstreamClient:
+    def __init__(self, base_url, pool_size=UPSTREAM_POOL_SIZE,
+                 connect_timeout=UPSTREAM_CONNECT_TIMEOUT, read_timeout=UPSTREAM_READ_TIMEOUT,
+                 retries=UPSTREAM_RETRIES, backoff=UPSTREAM_BACKOFF, breakers=None):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.breakers = breakers or CircuitBreakers()
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.budget = RetryBudget()
+        self.latency = LatencyRecorder()
+        self._session = None
+
+    def _get_session(self):
+        # The session must be created inside the running event loop.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def get_json(self, path, endpoint=None):
+        url = self.base_url + path
+        endpoint = endpoint or path
+        breaker = self.breakers.get(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {endpoint}")
+        try:
+            status, data = await self._get_json(url, endpoint)
+        except BaseException:
+            breaker.record(False)
+            raise
+        breaker.record(status not in RETRY_STATUSES)
+        return status, data
+
+    async def _get_json(self, url, endpoint):
+        session = self._get_session()
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    failed = response.status in RETRY_STATUSES
+                    data = await response.json(content_type=None) if response.status == 200 else None
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.latency.record(endpoint, time.perf_counter() - start, error=True)
+                if not self._should_retry(attempt):
+                    raise
+            else:
+                self.latency.record(endpoint, time.perf_counter() - start, error=failed)
+                if not failed or not self._should_retry(attempt):
+                    return status, data
+            await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+            attempt += 1
+
+    def _should_retry(self, attempt):
+        return attempt < self.retries and self.budget.withdraw()
+
+    def available(self, endpoint):
+        return self.breakers.get(endpoint).closed
+
+    def latency_stats(self):
+        return self.latency.stats()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+async_climatenet_client = AsyncUpstreamClient(CLIMATENET_BASE_URL, breakers=climatenet_client.breakers)
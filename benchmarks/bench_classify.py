@@ -0,0 +1,80 @@
+"""Classifying every station: the scalar classifiers versus one batch pass.
+
+Checks first that both agree on every reading, boundaries and missing
+values included.
+
+Run from the project root: python -m bot.benchmarks.bench_classify
+"""
+import random
+import timeit
+
+from bot.classifiers import (
+    PM_FIELDS, PM_LEVELS, UV_LEVELS, WEATHER_CONDITIONS, NO_CONDITION,
+    uv_index, pm_level, detect_weather_condition, measurement_columns, classify_measurements, classify_columns,
+    band_labels,
+)
+
+EQUIVALENCE_SAMPLES = 20000
+# Values on and around every threshold, plus the falsy zero.
+EDGES = {
+    'uv': [0, 1.9, 2, 2.9, 3, 3.5, 5, 5.5, 6, 7, 7.5, 8, 10, 10.5, 11, -1],
+    'lux': [0, 5, 5.5, 6, 99, 100, 299, 300, 301, 5000],
+    'temperature': [-5, 0, 0.9, 1, 1.1, 25],
+    'humidity': [0, 85, 85.5, 86, 90, 91, 100],
+    'pm1': [0, 50, 50.5, 100, 150, 200, 300, 301],
+    'pm2_5': [0, 12, 12.1, 36, 40, 41, 56, 151, 251, 252],
+    'pm10': [0, 54, 55, 154, 254, 354, 504, 505],
+}
+
+
+def measurement(edges=0.5):
+    values = {}
+    for field, edge_values in EDGES.items():
+        if random.random() < 0.1:
+            values[field] = None
+        elif random.random() < edges:
+            values[field] = random.choice(edge_values)
+        else:
+            values[field] = random.choice((random.randint(0, 600), round(random.uniform(-10, 600), 1)))
+    return values
+
+
+def scalar(measurements):
+    return [
+        (uv_index(m['uv']), pm_level(m['pm1'], "PM1.0"), pm_level(m['pm2_5'], "PM2.5"), pm_level(m['pm10'], "PM10"),
+         detect_weather_condition(m), detect_weather_condition(m, for_comparison=True))
+        for m in measurements
+    ]
+
+
+def batch(measurements):
+    bands = classify_measurements(measurements)
+    return list(zip(
+        band_labels(bands.uv, UV_LEVELS, " "),
+        *(band_labels(getattr(bands, field), PM_LEVELS, "N/A") for field in PM_FIELDS),
+        band_labels(bands.weather, WEATHER_CONDITIONS, NO_CONDITION),
+        band_labels(bands.weather, WEATHER_CONDITIONS, ""),
+    ))
+
+
+def main():
+    samples = [measurement() for _ in range(EQUIVALENCE_SAMPLES)]
+    mismatches = [(m, s, b) for m, s, b in zip(samples, scalar(samples), batch(samples)) if s != tuple(b)]
+    assert not mismatches, mismatches[:3]
+    print(f"{EQUIVALENCE_SAMPLES} readings classified identically\n")
+
+    # "batch" includes building the columns from the dicts, "columns" starts from them.
+    print(f"{'stations':>9} {'scalar ms':>10} {'batch ms':>9} {'speedup':>8} {'columns ms':>11} {'speedup':>8}")
+    for stations in (50, 500, 5000, 50000):
+        measurements = [measurement(edges=0) for _ in range(stations)]
+        repeat = max(3, 50000 // stations)
+        scalar_time = min(timeit.repeat(lambda: scalar(measurements), number=1, repeat=repeat))
+        batch_time = min(timeit.repeat(lambda: classify_measurements(measurements), number=1, repeat=repeat))
+        columns = measurement_columns(measurements)
+        columns_time = min(timeit.repeat(lambda: classify_columns(columns), number=1, repeat=repeat))
+        print(f"{stations:>9} {scalar_time * 1e3:>10.2f} {batch_time * 1e3:>9.2f} {scalar_time / batch_time:>7.1f}x "
+              f"{columns_time * 1e3:>11.2f} {scalar_time / columns_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
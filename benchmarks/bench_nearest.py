@@ -0,0 +1,42 @@
+"""Nearest-station query cost: a per-station haversine scan versus StationIndex.
+
+Run from the project root: python -m bot.benchmarks.bench_nearest
+"""
+import random
+import timeit
+
+from bot.geo import StationIndex, haversine_km
+
+QUERIES = 200
+K = 3
+
+
+def build_coordinates(stations):
+    # Spread over Armenia's bounding box, where the network is.
+    return {f"Station {i}": (random.uniform(38.8, 41.3), random.uniform(43.4, 46.6)) for i in range(stations)}
+
+
+def scan_nearest(coordinates, latitude, longitude, k=K):
+    distances = sorted(
+        (haversine_km(latitude, longitude, station_latitude, station_longitude), name)
+        for name, (station_latitude, station_longitude) in coordinates.items()
+    )
+    return [(name, distance) for distance, name in distances[:k]]
+
+
+def main():
+    print(f"{'stations':>9} {'scan µs':>9} {'index µs':>9} {'speedup':>8}")
+    for stations in (50, 500, 5000, 50000):
+        coordinates = build_coordinates(stations)
+        index = StationIndex(coordinates)
+        points = [(random.uniform(38.8, 41.3), random.uniform(43.4, 46.6)) for _ in range(QUERIES)]
+        for latitude, longitude in points[:20]:
+            expected = [name for name, _ in scan_nearest(coordinates, latitude, longitude)]
+            assert [name for name, _ in index.nearest(latitude, longitude, K)] == expected
+        scan = min(timeit.repeat(lambda: [scan_nearest(coordinates, *point) for point in points], number=1, repeat=3))
+        indexed = min(timeit.repeat(lambda: [index.nearest(*point, K) for point in points], number=1, repeat=3))
+        print(f"{stations:>9} {scan / QUERIES * 1e6:>9.1f} {indexed / QUERIES * 1e6:>9.1f} {scan / indexed:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
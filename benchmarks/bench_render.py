@@ -0,0 +1,42 @@
+"""Cost of formatting replies, cold versus served from the render cache.
+
+Run from the project root: python -m bot.benchmarks.bench_render
+"""
+import timeit
+
+from bot.rendering import Renderer
+
+CALLS = 2000
+
+
+def measurement(i):
+    return {
+        'timestamp': f"2024-05-01 12:{i % 4 * 15:02d}:00",
+        'uv': i % 11, 'lux': 1000 * i, 'temperature': 10.0 + i % 25, 'pressure': 850,
+        'humidity': 40 + i % 60, 'pm1': 5, 'pm2_5': 5 + 7 * (i % 20), 'pm10': 20,
+        'wind_speed': 0.5 * (i % 12), 'rain': i % 3, 'wind_direction': 'N',
+    }
+
+
+def main():
+    renderer = Renderer()
+    m1, m2 = measurement(3), measurement(8)
+    ranking = [(f"Station {i}", measurement(i)) for i in range(10)]
+    cases = (
+        ('single', lambda: renderer._render('Station 3', m1), lambda: renderer.render('Station 3', m1)),
+        ('comparison', lambda: renderer._render_comparison('Station 3', m1, 'Station 8', m2),
+         lambda: renderer.render_comparison('Station 3', m1, 'Station 8', m2)),
+        ('ranking x10', lambda: renderer.render_ranking(ranking), None),
+    )
+    print(f"{'reply':>12} {'cold µs':>9} {'cached µs':>10}")
+    for name, cold, cached in cases:
+        cold_time = min(timeit.repeat(cold, number=CALLS, repeat=3)) / CALLS
+        cached_text = '-'
+        if cached is not None:
+            cached()
+            cached_text = f"{min(timeit.repeat(cached, number=CALLS, repeat=3)) / CALLS * 1e6:.2f}"
+        print(f"{name:>12} {cold_time * 1e6:>9.2f} {cached_text:>10}")
+
+
+if __name__ == '__main__':
+    main()
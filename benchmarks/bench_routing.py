@@ -0,0 +1,55 @@
+"""Dispatch cost of the message filters as the station count grows.
+
+Run from the project root: python -m bot.benchmarks.bench_routing
+"""
+import random
+import timeit
+
+from bot.routing import RoutingIndex, COUNTRY, DEVICE
+
+STATIONS_PER_REGION = 20
+MESSAGES = 1000
+
+
+def build_catalog(stations):
+    locations = {}
+    device_ids = {}
+    for i in range(stations):
+        region = f"Region {i // STATIONS_PER_REGION}"
+        name = f"Station {i}"
+        locations.setdefault(region, []).append(name)
+        device_ids[name] = f"id{i}"
+    return locations, device_ids
+
+
+def scan_dispatch(locations, texts):
+    # The filters as they were: a keys() test plus a flattened list scan per message.
+    for text in texts:
+        if text in locations.keys():
+            continue
+        if text in [device for devices in locations.values() for device in devices]:
+            continue
+
+
+def index_dispatch(router, texts):
+    for text in texts:
+        kind = router.kind(text)
+        if kind == COUNTRY or kind == DEVICE:
+            continue
+
+
+def main():
+    print(f"{'stations':>9} {'scan µs/msg':>12} {'index µs/msg':>13} {'speedup':>9}")
+    for stations in (50, 200, 1000, 5000, 20000):
+        locations, device_ids = build_catalog(stations)
+        router = RoutingIndex(locations, device_ids)
+        names = list(device_ids) + list(locations) + ['/Current', 'hello']
+        texts = [random.choice(names) for _ in range(MESSAGES)]
+        repeat = max(1, 20000 // stations)
+        scan = min(timeit.repeat(lambda: scan_dispatch(locations, texts), number=1, repeat=3)) / MESSAGES
+        index = min(timeit.repeat(lambda: index_dispatch(router, texts), number=repeat, repeat=3)) / repeat / MESSAGES
+        print(f"{stations:>9} {scan * 1e6:>12.2f} {index * 1e6:>13.3f} {scan / index:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
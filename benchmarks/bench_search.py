@@ -0,0 +1,66 @@
+"""Inline search cost: a scan with difflib versus SearchIndex.
+
+Run from the project root: python -m bot.benchmarks.bench_search
+"""
+import difflib
+import random
+import timeit
+
+from bot.search import SearchIndex, normalize
+
+SYLLABLES = ('ar', 'ga', 'var', 'ber', 'dzor', 'ash', 'tsk', 'am', 'as', 'ia', 'ka', 'pan', 'yer', 'van', 'kh', 'ats')
+QUERIES = 500
+LIMIT = 10
+
+
+def station_name():
+    name = "".join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4))).capitalize()
+    return name if random.random() < 0.8 else f"{name} {random.choice(('Lake', 'Station', 'Pass'))}"
+
+
+def build_catalog(stations):
+    names = {station_name() for _ in range(stations)}
+    locations = {}
+    for i, name in enumerate(sorted(names)):
+        locations.setdefault(f"Region {i % 11}", []).append(name)
+    return locations, {name: f"id-{i}" for i, name in enumerate(sorted(names))}
+
+
+def typo(name):
+    position = random.randrange(1, len(name))
+    return name[:position] + name[position + 1:]
+
+
+def scan_search(names, query, limit=LIMIT):
+    query = normalize(query)
+    found = [name for name in names if normalize(name).startswith(query)][:limit]
+    if len(found) < limit:
+        found += [name for name in difflib.get_close_matches(query, names, limit, 0.6) if name not in found]
+    return found[:limit]
+
+
+def main():
+    print(f"{'stations':>9} {'query':>7} {'scan µs':>9} {'index µs':>9} {'speedup':>8}")
+    for stations in (50, 500, 5000):
+        locations, device_ids = build_catalog(stations)
+        index = SearchIndex(locations, device_ids)
+        names = list(device_ids)
+        samples = random.choices(names, k=QUERIES)
+        workloads = {
+            'prefix': [name[:3] for name in samples],
+            'typo': [typo(name) for name in samples],
+        }
+        for label, queries in workloads.items():
+            for query in queries[:50]:
+                matches = index.search(query, LIMIT)
+                assert matches
+                if label == 'prefix':
+                    assert normalize(matches[0].name).startswith(normalize(query))
+            scan = min(timeit.repeat(lambda: [scan_search(names, query) for query in queries], number=1, repeat=3))
+            indexed = min(timeit.repeat(lambda: [index.search(query, LIMIT) for query in queries], number=1, repeat=3))
+            print(f"{stations:>9} {label:>7} {scan / QUERIES * 1e6:>9.1f} {indexed / QUERIES * 1e6:>9.1f} "
+                  f"{scan / indexed:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Memory per chat for the session store against the old dict-of-dicts user_context.
+
+Run from the project root: python -m bot.benchmarks.bench_sessions [chats]
+"""
+import sys
+import tracemalloc
+
+from bot.sessions import InMemorySessionStore
+
+DEVICES = [(f"Station {i}", f"id{i:04d}", f"Region {i // 20}") for i in range(200)]
+
+
+def fill_dicts(chats):
+    user_context = {}
+    for chat_id in range(chats):
+        name, device_id, region = DEVICES[chat_id % len(DEVICES)]
+        user_context[chat_id] = {'selected_country': region, 'selected_device': name, 'device_id': device_id}
+    return user_context
+
+
+def fill_store(chats):
+    store = InMemorySessionStore(max_size=chats, idle_ttl=float('inf'))
+    for chat_id in range(chats):
+        name, device_id, region = DEVICES[chat_id % len(DEVICES)]
+        state = store.get(chat_id)
+        state.selected_country = region
+        state.selected_device = name
+        state.device_id = device_id
+    return store
+
+
+def measure(fill, chats):
+    tracemalloc.start()
+    container = fill(chats)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del container
+    return current
+
+
+def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{'backend':<22} {'bytes/chat':>11} {'MiB per 1M chats':>17}")
+    for label, fill in (('dict user_context', fill_dicts), ('InMemorySessionStore', fill_store)):
+        per_chat = measure(fill, chats) / chats
+        print(f"{label:<22} {per_chat:>11.0f} {per_chat * 1_000_000 / 2 ** 20:>17.0f}")
+
+
+if __name__ == '__main__':
+    main()
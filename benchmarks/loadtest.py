@@ -0,0 +1,361 @@
+"""Offline load test: replays synthetic user sessions against local stand-ins
+for the climatenet API and the Telegram Bot API.
+
+Run from the project root with the Django settings configured (point them at
+a scratch database, the analytics writes are real). The bot's own stores
+(catalog, history, sessions, alerts) go to a temporary directory:
+
+    python -m bot.benchmarks.loadtest --rate 5 --duration 30 --upstream-latency 0.05
+    python -m bot.benchmarks.loadtest --rate 40 --workers 4 --global-rate 1000
+
+Both fake servers have configurable latency and error rates. Each session is
+start -> country -> device -> /Current -> /Compare (two more countries and
+devices); a step's latency is the time until the bot's first reply.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TOKEN = '1000:loadtest'
+
+
+class FakeClimatenet:
+    def __init__(self, devices=60, regions=6, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self.errors = Counter()
+        self._lock = threading.Lock()
+        self.devices = [
+            {
+                "name": f"Station {i}",
+                "generated_id": f"gen{i}",
+                "parent_name": f"Region {i % regions}",
+                "latitude": 39.0 + random.random() * 2,
+                "longitude": 43.5 + random.random() * 3,
+            }
+            for i in range(devices)
+        ]
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parts = [part for part in urlparse(self.path).path.split('/') if part]
+                endpoint = 'device_list' if parts[-1] == 'list' else parts[-1]
+                with fake._lock:
+                    fake.requests[endpoint] += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if random.random() < fake.error_rate:
+                    with fake._lock:
+                        fake.errors[endpoint] += 1
+                    return fake._reply(self, 500, {"detail": "injected error"})
+                if endpoint == 'device_list':
+                    return fake._reply(self, 200, fake.devices)
+                return fake._reply(self, 200, [fake.measurement(parts[1])])
+
+        return Handler
+
+    def measurement(self, device_id):
+        seed = sum(map(ord, device_id))
+        now = time.gmtime(time.time() // 900 * 900)
+        return {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S', now),
+            "uv": seed % 11, "lux": 100 * (seed % 50), "temperature": round(5 + seed % 25 + random.random(), 1),
+            "pressure": 850 + seed % 30, "humidity": 30 + seed % 60, "pm1": seed % 20, "pm2_5": seed % 80,
+            "pm10": seed % 120, "speed": (seed % 10) / 2, "rain": seed % 3, "wind_direction": "N",
+        }
+
+    @staticmethod
+    def _reply(handler, status, body):
+        payload = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-climatenet', daemon=True).start()
+        return self
+
+
+class FakeTelegram:
+    # Implements the Bot API methods the bot uses. Updates are injected by the
+    # driver and handed out through getUpdates; sent messages are recorded per chat.
+    def __init__(self, latency=0.0, flood_rate=0.0, poll_timeout=1.0):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.poll_timeout = poll_timeout
+        self.calls = Counter()
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._replies = defaultdict(list)
+        self._condition = threading.Condition()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._dispatch()
+
+            def do_POST(self):
+                self._dispatch()
+
+            def _dispatch(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+                status, payload = fake.call(method, params)
+                FakeClimatenet._reply(self, status, payload)
+
+        return Handler
+
+    def call(self, method, params):
+        with self._condition:
+            self.calls[method] += 1
+        if method == 'getUpdates':
+            return 200, {"ok": True, "result": self._get_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0))}
+        if method in ('sendMessage', 'sendPhoto'):
+            if self.latency:
+                time.sleep(self.latency)
+            if random.random() < self.flood_rate:
+                with self._condition:
+                    self.calls['429'] += 1
+                return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                             "parameters": {"retry_after": 1}}
+            return 200, {"ok": True, "result": self._record(int(params['chat_id']), params.get('text') or 'PHOTO')}
+        if method == 'getMe':
+            return 200, {"ok": True, "result": {"id": 1000, "is_bot": True, "first_name": "Loadtest", "username": "loadtest_bot"}}
+        return 200, {"ok": True, "result": True}
+
+    def _get_updates(self, offset, timeout):
+        deadline = time.monotonic() + min(timeout, self.poll_timeout)
+        with self._condition:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            return list(self._updates[:100])
+
+    def _record(self, chat_id, text):
+        with self._condition:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self._replies[chat_id].append((time.perf_counter(), text))
+            self._condition.notify_all()
+        return {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    def inject(self, chat_id, text):
+        with self._condition:
+            message = {
+                "message_id": self._next_update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"},
+                "text": text,
+            }
+            if text.startswith('/'):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+            self._updates.append({"update_id": self._next_update_id, "message": message})
+            self._next_update_id += 1
+            seen = len(self._replies[chat_id])
+            self._condition.notify_all()
+        return seen, time.perf_counter()
+
+    def wait_reply(self, chat_id, seen, timeout, settle=0.2):
+        # Returns the arrival time of the first new reply, then waits for the chat to go quiet.
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while len(self._replies[chat_id]) <= seen:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            first = self._replies[chat_id][seen][0]
+            count = len(self._replies[chat_id])
+            while True:
+                self._condition.wait(settle)
+                if len(self._replies[chat_id]) == count or time.monotonic() > deadline:
+                    return first
+                count = len(self._replies[chat_id])
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-telegram', daemon=True).start()
+        return self
+
+
+def session_plan(devices):
+    by_region = defaultdict(list)
+    for device in devices:
+        by_region[device["parent_name"]].append(device["name"])
+    regions = list(by_region)
+    first, second, third = (random.choice(regions) for _ in range(3))
+    return [
+        ('start', '/start'),
+        ('country', first),
+        ('device', random.choice(by_region[first])),
+        ('current', '/Current'),
+        ('compare', '/Compare'),
+        ('compare_country', second),
+        ('compare_device', random.choice(by_region[second])),
+        ('compare_country', third),
+        ('compare_device', random.choice(by_region[third])),
+    ]
+
+
+def run_session(chat_id, plan, telegram, results, timeout):
+    for step, text in plan:
+        seen, sent_at = telegram.inject(chat_id, text)
+        replied_at = telegram.wait_reply(chat_id, seen, timeout)
+        if replied_at is None:
+            results.fail(step)
+            return
+        results.record(step, replied_at - sent_at)
+    results.complete()
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.failures = Counter()
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def record(self, step, seconds):
+        with self._lock:
+            self.latencies[step].append(seconds)
+
+    def fail(self, step):
+        with self._lock:
+            self.failures[step] += 1
+
+    def complete(self):
+        with self._lock:
+            self.completed += 1
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else float('nan')
+
+
+def report(results, started, elapsed, climatenet, telegram):
+    all_latencies = [value for values in results.latencies.values() for value in values]
+    print(f"sessions: {started} started, {results.completed} completed, {sum(results.failures.values())} timed out")
+    print(f"updates:  {len(all_latencies)} answered in {elapsed:.1f}s ({len(all_latencies) / elapsed:.1f}/s)")
+    print(f"latency:  p50 {percentile(all_latencies, 0.5) * 1000:.0f} ms, p99 {percentile(all_latencies, 0.99) * 1000:.0f} ms")
+    print(f"{'step':>16} {'count':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for step, values in results.latencies.items():
+        print(f"{step:>16} {len(values):>6} {percentile(values, 0.5) * 1000:>8.0f} {percentile(values, 0.99) * 1000:>8.0f}")
+    print(f"upstream requests: {dict(climatenet.requests)}, injected errors: {dict(climatenet.errors)}")
+    print(f"telegram calls: {dict(telegram.calls)}")
+    if results.failures:
+        print(f"timeouts by step: {dict(results.failures)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=2.0, help='new sessions per second')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds to keep starting sessions')
+    parser.add_argument('--devices', type=int, default=60)
+    parser.add_argument('--upstream-latency', type=float, default=0.05)
+    parser.add_argument('--upstream-error-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--telegram-flood-rate', type=float, default=0.0, help='share of sends answered with 429')
+    parser.add_argument('--timeout', type=float, default=15.0, help='seconds to wait for a reply')
+    parser.add_argument('--engine', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--workers', type=int, default=0, help='bot processes; 0 runs the bot in this process')
+    parser.add_argument('--global-rate', type=float, help="overrides OUTBOX_GLOBAL_RATE, Telegram's 30/s cap")
+    args = parser.parse_args()
+
+    climatenet = FakeClimatenet(args.devices, latency=args.upstream_latency, error_rate=args.upstream_error_rate).start()
+    telegram = FakeTelegram(latency=args.telegram_latency, flood_rate=args.telegram_flood_rate).start()
+    # Everything below reads these at import time.
+    os.environ['CLIMATENET_BASE_URL'] = climatenet.url
+    os.environ['TELEGRAM_API_URL'] = telegram.url
+    os.environ['TELEGRAM_BOT_TOKEN'] = TOKEN
+    os.environ['BOT_MODE'] = 'sharded' if args.workers else 'polling'
+    os.environ['BOT_WORKERS'] = str(args.workers)
+    if args.global_rate:
+        os.environ['OUTBOX_GLOBAL_RATE'] = str(args.global_rate)
+    os.environ['BOT_ENGINE'] = args.engine
+    scratch = tempfile.mkdtemp(prefix='loadtest-')
+    os.environ['CATALOG_SNAPSHOT_PATH'] = os.path.join(scratch, 'catalog.json')
+    os.environ['HISTORY_DIR'] = os.path.join(scratch, 'history')
+    os.environ['SESSION_DB_PATH'] = os.path.join(scratch, 'sessions.sqlite3')
+    os.environ['ALERTS_DB_PATH'] = os.path.join(scratch, 'alerts.sqlite3')
+    os.environ['ALERTS_LOCK_PATH'] = os.path.join(scratch, 'alerts.sqlite3.lock')
+
+    import django
+    django.setup()
+    from bot import views
+
+    views.start_bot_thread()
+    # The catalog is fetched in the background; sessions need it to pick devices.
+    deadline = time.monotonic() + args.timeout
+    while not views.device_ids and time.monotonic() < deadline:
+        time.sleep(0.05)
+    results = Results()
+    sessions = []
+    started_at = time.perf_counter()
+    chat_id = 100000
+    while time.perf_counter() - started_at < args.duration:
+        chat_id += 1
+        session = threading.Thread(
+            target=run_session,
+            args=(chat_id, session_plan(climatenet.devices), telegram, results, args.timeout),
+            daemon=True,
+        )
+        session.start()
+        sessions.append(session)
+        time.sleep(random.expovariate(args.rate))
+    for session in sessions:
+        session.join(args.timeout * 10)
+    report(results, len(sessions), time.perf_counter() - started_at, climatenet, telegram)
+    # The polling thread is deliberately not a daemon, so leave without waiting for it.
+    views.write_buffer.close()
+    if views.shard_supervisor is not None:
+        views.shard_supervisor.stop()
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
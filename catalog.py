@@ -0,0 +1,148 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CATALOG_SNAPSHOT_PATH = os.getenv('CATALOG_SNAPSHOT_PATH', 'bot_catalog.json')
+CATALOG_REFRESH_INTERVAL = float(os.getenv('CATALOG_REFRESH_INTERVAL', '3600'))
+CATALOG_RETRY_MAX = float(os.getenv('CATALOG_RETRY_MAX', '300'))
+CATALOG_WATCH_INTERVAL = float(os.getenv('CATALOG_WATCH_INTERVAL', '5'))
+
+
+def snapshot_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_snapshot(path):
+    try:
+        with open(path, encoding='utf-8') as snapshot:
+            data = json.load(snapshot)
+        coordinates = {name: tuple(position) if position else None for name, position in data['coordinates'].items()}
+        return (data['locations'], data['device_ids'], coordinates), data.get('saved_at')
+    except FileNotFoundError:
+        return None, None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Error reading catalog snapshot {path}: {e}")
+        return None, None
+
+
+def save_snapshot(path, catalog, saved_at):
+    locations, device_ids, coordinates = catalog
+    data = {'saved_at': saved_at, 'locations': locations, 'device_ids': device_ids, 'coordinates': coordinates}
+    # Write next to the target and rename over it, so a reader never sees half a file.
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(prefix='.catalog-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as snapshot:
+            json.dump(data, snapshot, ensure_ascii=False)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class CatalogLoader:
+    # Startup applies the catalog saved by the last successful fetch, so
+    # importing the views never waits on the network. A background thread
+    # fetches the device list, applies it and rewrites the snapshot. A failed
+    # or empty fetch keeps the catalog we have and is retried with backoff.
+    # Processes that share the snapshot with a fetching one (shard workers)
+    # follow the file instead of fetching.
+    def __init__(self, fetch, apply, path=CATALOG_SNAPSHOT_PATH, interval=CATALOG_REFRESH_INTERVAL,
+                 retry_max=CATALOG_RETRY_MAX):
+        self.fetch = fetch
+        self.apply = apply
+        self.path = path
+        self.interval = interval
+        self.retry_max = retry_max
+        self.source = None
+        self.devices = 0
+        self.updated_at = None
+        self.refreshes = 0
+        self.failures = 0
+        self._loaded_mtime = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def load(self):
+        mtime = snapshot_mtime(self.path)
+        catalog, saved_at = load_snapshot(self.path)
+        if catalog is None:
+            return False
+        self._apply(catalog, 'snapshot', saved_at)
+        self._loaded_mtime = mtime
+        return True
+
+    def start(self):
+        return self._start(self._run, 'catalog-refresh')
+
+    def follow(self, interval=CATALOG_WATCH_INTERVAL):
+        return self._start(lambda: self._follow(interval), 'catalog-follow')
+
+    def _start(self, target, name):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=target, name=name, daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        delay = 1
+        while not self._stop.is_set():
+            if self.refresh():
+                delay = 1
+                self._stop.wait(self.interval)
+            else:
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.retry_max)
+
+    def _follow(self, interval):
+        while not self._stop.wait(interval):
+            mtime = snapshot_mtime(self.path)
+            if mtime is not None and mtime != self._loaded_mtime:
+                self.load()
+
+    def refresh(self):
+        catalog = self.fetch()
+        if catalog is None or not catalog[1]:
+            self.failures += 1
+            return False
+        now = time.time()
+        self._apply(catalog, 'upstream', now)
+        self.refreshes += 1
+        try:
+            save_snapshot(self.path, catalog, now)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing catalog snapshot {self.path}: {e}")
+        return True
+
+    def _apply(self, catalog, source, updated_at):
+        self.apply(*catalog)
+        self.source = source
+        self.devices = len(catalog[1])
+        self.updated_at = updated_at
+
+    def stats(self):
+        return {
+            'devices': self.devices,
+            'from_snapshot': self.source == 'snapshot',
+            'age_seconds': round(time.time() - self.updated_at) if self.updated_at else None,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+        }
@@ -0,0 +1,137 @@
+from collections import namedtuple
+
+import numpy as np
+
+PM_THRESHOLDS = {
+    "PM1.0": [50, 100, 150, 200, 300],
+    "PM2.5": [12, 36, 56, 151, 251],
+    "PM10": [54, 154, 254, 354, 504]
+}
+PM_LEVELS = [
+    "Good 🟢",
+    "Moderate 🟡",
+    "Unhealthy for Sensitive Groups 🟠",
+    "Unhealthy 🟠",
+    "Very Unhealthy 🔴",
+    "Hazardous 🔴"
+]
+UV_LEVELS = ["Low 🟢", "Moderate 🟡", "High 🟠", "Very High 🔴", "Extreme 🟣"]
+WEATHER_CONDITIONS = ["Possibly Snowing ❄️", "Foggy 🌫️", "Cloudy ☁️", "Sunny ☀️"]
+NO_CONDITION = "Nothing detected ❌"
+
+# The batch classifiers take the whole network in one pass and must agree
+# with the scalar ones value for value, gaps included (a UV of 5.5 is
+# "Extreme", a lux of 0 is never cloudy); bench_classify checks that.
+# Their band codes index the level lists above. MISSING is a reading that
+# was not reported, or for weather, no condition detected.
+MISSING = -1
+BATCH_FIELDS = ('uv', 'lux', 'temperature', 'humidity', 'pm1', 'pm2_5', 'pm10')
+PM_FIELDS = {'pm1': "PM1.0", 'pm2_5': "PM2.5", 'pm10': "PM10"}
+
+Bands = namedtuple('Bands', ['uv', 'pm1', 'pm2_5', 'pm10', 'weather'])
+
+
+def uv_index(uv):
+    if uv is None:
+        return " "
+    if uv < 3:
+        return UV_LEVELS[0]
+    elif 3 <= uv <= 5:
+        return UV_LEVELS[1]
+    elif 6 <= uv <= 7:
+        return UV_LEVELS[2]
+    elif 8 <= uv <= 10:
+        return UV_LEVELS[3]
+    else:
+        return UV_LEVELS[4]
+
+
+def pm_level(pm, pollutant):
+    if pm is None:
+        return "N/A"
+    thresholds = PM_THRESHOLDS.get(pollutant, [])
+    for i, limit in enumerate(thresholds):
+        if pm <= limit:
+            return PM_LEVELS[i]
+    return PM_LEVELS[-1]
+
+
+def detect_weather_condition(measurement, for_comparison=False):
+    temperature = measurement.get("temperature")
+    humidity = measurement.get("humidity")
+    lux = measurement.get("lux")
+    pm2_5 = measurement.get("pm2_5")
+    uv = measurement.get("uv")
+    if temperature is not None and temperature < 1 and humidity and humidity > 85:
+        return WEATHER_CONDITIONS[0]
+    elif lux is not None and lux < 100 and humidity and humidity > 90 and pm2_5 and pm2_5 > 40:
+        return WEATHER_CONDITIONS[1]
+    elif lux and lux < 300 and uv and uv < 2:
+        return WEATHER_CONDITIONS[2]
+    elif lux and lux > 5 and uv and uv > 3:
+        return WEATHER_CONDITIONS[3]
+    else:
+        return "" if for_comparison else NO_CONDITION
+
+
+def measurement_columns(measurements, fields=BATCH_FIELDS):
+    # One float column per field. None becomes NaN, which fails every
+    # comparison below just like the scalar "is not None" checks.
+    return {
+        field: np.array([np.nan if measurement.get(field) is None else measurement[field]
+                         for measurement in measurements], dtype=np.float64)
+        for field in fields
+    }
+
+
+def uv_bands(uv):
+    bands = np.select(
+        [uv < 3, (uv >= 3) & (uv <= 5), (uv >= 6) & (uv <= 7), (uv >= 8) & (uv <= 10)],
+        [0, 1, 2, 3],
+        len(UV_LEVELS) - 1,
+    )
+    bands[np.isnan(uv)] = MISSING
+    return bands
+
+
+def pm_bands(pm, pollutant):
+    thresholds = PM_THRESHOLDS.get(pollutant, [])
+    # First threshold the reading does not exceed, as in pm_level.
+    bands = np.searchsorted(np.array(thresholds, dtype=np.float64), pm, side='left')
+    bands[bands == len(thresholds)] = len(PM_LEVELS) - 1
+    bands[np.isnan(pm)] = MISSING
+    return bands
+
+
+def weather_conditions(columns):
+    temperature, humidity = columns['temperature'], columns['humidity']
+    lux, uv, pm2_5 = columns['lux'], columns['uv'], columns['pm2_5']
+    return np.select(
+        [
+            (temperature < 1) & (humidity > 85),
+            (lux < 100) & (humidity > 90) & (pm2_5 > 40),
+            (lux != 0) & (lux < 300) & (uv != 0) & (uv < 2),
+            (lux > 5) & (uv > 3),
+        ],
+        [0, 1, 2, 3],
+        MISSING,
+    )
+
+
+def classify_measurements(measurements):
+    return classify_columns(measurement_columns(measurements))
+
+
+def classify_columns(columns):
+    return Bands(
+        uv=uv_bands(columns['uv']),
+        pm1=pm_bands(columns['pm1'], PM_FIELDS['pm1']),
+        pm2_5=pm_bands(columns['pm2_5'], PM_FIELDS['pm2_5']),
+        pm10=pm_bands(columns['pm10'], PM_FIELDS['pm10']),
+        weather=weather_conditions(columns),
+    )
+
+
+def band_labels(bands, levels, missing):
+    # The level for every code, with MISSING mapped to the given label.
+    return np.array(list(levels) + [missing], dtype=object)[bands]
@@ -0,0 +1,63 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def unit_vectors(latitudes, longitudes):
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack((cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)))
+
+
+class StationIndex:
+    # Stations are kept as unit vectors on the sphere. The nearest stations
+    # are the ones with the largest dot product with the query point, so a
+    # query is one matrix-vector product and a partial sort. The great-circle
+    # distance is the haversine form of the chord between the two vectors.
+    def __init__(self, coordinates=None):
+        self.rebuild(coordinates or {})
+
+    def rebuild(self, coordinates):
+        # coordinates: {name: (latitude, longitude)}; stations without a position are skipped.
+        names, latitudes, longitudes = [], [], []
+        for name, position in coordinates.items():
+            if position is None:
+                continue
+            latitude, longitude = position
+            if latitude is None or longitude is None:
+                continue
+            names.append(name)
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+        # Swap both in one assignment so a concurrent query sees a consistent pair.
+        self._stations = (names, unit_vectors(latitudes, longitudes) if names else np.empty((0, 3)))
+
+    def nearest(self, latitude, longitude, k=3):
+        names, vectors = self._stations
+        if not names:
+            return []
+        k = min(k, len(names))
+        latitude, longitude = math.radians(latitude), math.radians(longitude)
+        point = np.array((math.cos(latitude) * math.cos(longitude), math.cos(latitude) * math.sin(longitude), math.sin(latitude)))
+        similarity = vectors @ point
+        if k < len(names):
+            candidates = np.argpartition(-similarity, k - 1)[:k]
+        else:
+            candidates = np.arange(len(names))
+        candidates = candidates[np.argsort(-similarity[candidates])]
+        chords = np.linalg.norm(vectors[candidates] - point, axis=1)
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chords / 2, 1.0))
+        return [(names[i], float(distance)) for i, distance in zip(candidates, distances)]
+
+    def __len__(self):
+        return len(self._stations[0])
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = (math.sin((latitude2 - latitude1) / 2) ** 2
+         + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
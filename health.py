@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from bot.upstream import RETRY_STATUSES
+
+load_dotenv()
+
+DEVICE_FAILURE_WINDOW = int(os.getenv('DEVICE_FAILURE_WINDOW', '10'))
+DEVICE_FAILURE_RATE = float(os.getenv('DEVICE_FAILURE_RATE', '0.5'))
+DEVICE_STALE_AFTER = float(os.getenv('DEVICE_STALE_AFTER', str(2 * 3600)))
+# Fewer answers than this say nothing about a station yet.
+MIN_SAMPLES = 3
+
+OK, STALE, FAILING = 'ok', 'stale', 'failing'
+
+
+class DeviceHealth:
+    # Derived from what the bot observes instead of a hand-kept list. A
+    # station is failing when most of its recent answers came back without
+    # data, and stale when its reading has not changed for a long time.
+    # Upstream errors and open circuits say nothing about the station, so
+    # they are not counted.
+    def __init__(self, snapshot, window=DEVICE_FAILURE_WINDOW, failure_rate=DEVICE_FAILURE_RATE,
+                 stale_after=DEVICE_STALE_AFTER, clock=time.time):
+        self.snapshot = snapshot
+        self.window = window
+        self.failure_rate = failure_rate
+        self.stale_after = stale_after
+        self.clock = clock
+        self._outcomes = {}
+        self._lock = threading.Lock()
+
+    def record(self, device_id, status, data):
+        if status in RETRY_STATUSES:
+            return
+        with self._lock:
+            outcomes = self._outcomes.get(device_id)
+            if outcomes is None:
+                outcomes = self._outcomes[device_id] = deque(maxlen=self.window)
+            outcomes.append(status == 200 and bool(data))
+
+    def status(self, device_id):
+        outcomes = self._outcomes.get(device_id)
+        if outcomes is not None and len(outcomes) >= MIN_SAMPLES:
+            failures = len(outcomes) - sum(outcomes)
+            if failures / len(outcomes) >= self.failure_rate:
+                return FAILING
+        entry = self.snapshot.get(device_id)
+        if entry is not None and self.clock() - entry.updated_at > self.stale_after:
+            return STALE
+        return OK
+
+    def has_issues(self, device_id):
+        return device_id is not None and self.status(device_id) != OK
+
+    def stats(self, device_ids=()):
+        counts = {OK: 0, STALE: 0, FAILING: 0}
+        for device_id in device_ids:
+            counts[self.status(device_id)] += 1
+        return counts
@@ -0,0 +1,193 @@
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from operator import itemgetter
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process lock; fine as long as a single process writes history.
+    fcntl = None
+
+load_dotenv()
+
+HISTORY_DIR = os.getenv('HISTORY_DIR', 'bot_history')
+HISTORY_METRICS = ('uv', 'lux', 'temperature', 'pressure', 'humidity', 'pm1', 'pm2_5', 'pm10', 'wind_speed', 'rain')
+
+TIME_COLUMN = 'time'
+TIME_DTYPE = np.dtype('<i8')
+VALUE_DTYPE = np.dtype('<f4')
+
+
+def to_epoch(timestamp):
+    # Station timestamps carry no zone; they are stored as if they were UTC so
+    # that from_epoch gives back the same wall-clock time.
+    moment = datetime.fromisoformat(timestamp)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def from_epoch(seconds):
+    return datetime.fromtimestamp(int(seconds), timezone.utc).strftime('%Y-%m-%d %H:%M')
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class HistoryStore:
+    # Each device gets a directory with one raw little-endian file per column.
+    # Rows are only ever appended in time order, and reads go through np.memmap,
+    # so a query touches the pages of the requested range and nothing else.
+    # Metric columns are written before the time column, which makes the time
+    # column's length the number of complete rows. Every web process may run
+    # a poller, so appends take a per-device file lock and re-read the last
+    # time under it; readers treat a missing metric file as empty.
+    def __init__(self, root=HISTORY_DIR, metrics=HISTORY_METRICS):
+        self.root = root
+        self.metrics = tuple(metrics)
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, device_id):
+        with self._guard:
+            lock = self._locks.get(device_id)
+            if lock is None:
+                lock = self._locks[device_id] = threading.Lock()
+            return lock
+
+    @contextmanager
+    def _writing(self, device_id):
+        directory = os.path.dirname(self._path(device_id, TIME_COLUMN))
+        with self._lock(device_id):
+            os.makedirs(directory, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(directory, '.lock'), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _path(self, device_id, column):
+        extension = 'i8' if column == TIME_COLUMN else 'f4'
+        return os.path.join(self.root, str(device_id).replace(os.sep, '_'), f"{column}.{extension}")
+
+    def _rows(self, device_id):
+        try:
+            return os.path.getsize(self._path(device_id, TIME_COLUMN)) // TIME_DTYPE.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def _column(self, device_id, column, rows):
+        dtype = TIME_DTYPE if column == TIME_COLUMN else VALUE_DTYPE
+        if rows == 0:
+            return np.empty(0, dtype)
+        path = self._path(device_id, column)
+        try:
+            available = os.path.getsize(path) // dtype.itemsize
+        except FileNotFoundError:
+            available = 0
+        if available >= rows:
+            return np.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+        # A metric added after the device started recording, not padded by a writer yet.
+        values = np.full(rows, np.nan, dtype)
+        if available:
+            values[:available] = np.memmap(path, dtype=dtype, mode='r', shape=(available,))
+        return values
+
+    def _last_time(self, device_id):
+        # Called with the write locks held, so another process may have
+        # appended since the last call. Also repairs columns left uneven by an
+        # interrupted append.
+        rows = self._rows(device_id)
+        if not rows:
+            return -1
+        self._align(device_id, rows)
+        return int(self._column(device_id, TIME_COLUMN, rows)[-1])
+
+    def _align(self, device_id, rows):
+        for metric in self.metrics:
+            path = self._path(device_id, metric)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            expected = rows * VALUE_DTYPE.itemsize
+            if size > expected:
+                os.truncate(path, expected)
+            elif size < expected:
+                # A metric added after the device started recording.
+                with open(path, 'ab') as column:
+                    column.write(np.full((expected - size) // VALUE_DTYPE.itemsize, np.nan, VALUE_DTYPE).tobytes())
+
+    def append(self, device_id, measurement):
+        return self.extend(device_id, [measurement])
+
+    def extend(self, device_id, measurements):
+        rows = sorted(
+            ((to_epoch(measurement['timestamp']), measurement)
+             for measurement in measurements if measurement and measurement.get('timestamp')),
+            key=itemgetter(0),
+        )
+        with self._writing(device_id):
+            last = self._last_time(device_id)
+            fresh = []
+            for seconds, measurement in rows:
+                if seconds > last:
+                    fresh.append((seconds, measurement))
+                    last = seconds
+            if not fresh:
+                return 0
+            for metric in self.metrics:
+                values = np.array([_number(measurement.get(metric)) for _, measurement in fresh], VALUE_DTYPE)
+                with open(self._path(device_id, metric), 'ab') as column:
+                    column.write(values.tobytes())
+            with open(self._path(device_id, TIME_COLUMN), 'ab') as column:
+                column.write(np.array([seconds for seconds, _ in fresh], TIME_DTYPE).tobytes())
+        return len(fresh)
+
+    def latest_time(self, device_id):
+        rows = self._rows(device_id)
+        return int(self._column(device_id, TIME_COLUMN, rows)[-1]) if rows else None
+
+    def window(self, device_id, start, end, metrics=None):
+        # Rows with start <= time <= end, copied out of the mapped files.
+        metrics = self.metrics if metrics is None else metrics
+        rows = self._rows(device_id)
+        times = self._column(device_id, TIME_COLUMN, rows)
+        low = int(np.searchsorted(times, start, side='left'))
+        high = int(np.searchsorted(times, end, side='right'))
+        columns = {metric: np.array(self._column(device_id, metric, rows)[low:high]) for metric in metrics}
+        return np.array(times[low:high]), columns
+
+    def downsample(self, device_id, start, end, buckets, metrics=None):
+        # Splits [start, end] into equal buckets and returns the bucket start
+        # times plus (min, mean, max) per metric; empty buckets are NaN.
+        times, columns = self.window(device_id, start, end, metrics)
+        step = (end - start) / buckets
+        edges = start + step * np.arange(buckets)
+        starts = np.searchsorted(times, edges, side='left')
+        counts = np.diff(np.append(starts, len(times)))
+        filled = counts > 0
+        offsets = starts[filled]
+        summary = {}
+        for metric, values in columns.items():
+            lows, means, highs = (np.full(buckets, np.nan) for _ in range(3))
+            if len(offsets):
+                present = ~np.isnan(values)
+                totals = np.add.reduceat(np.where(present, values, 0).astype(np.float64), offsets)
+                samples = np.add.reduceat(present.astype(np.int64), offsets)
+                lows[filled] = np.fmin.reduceat(values, offsets)
+                highs[filled] = np.fmax.reduceat(values, offsets)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    means[filled] = np.where(samples > 0, totals / samples, np.nan)
+            summary[metric] = (lows, means, highs)
+        return edges, summary
@@ -0,0 +1,53 @@
+import threading
+
+from telebot import types
+
+
+class PreparedMarkup(types.JsonSerializable):
+    # telebot calls to_json() on every send; this hands back the payload serialized at build time.
+    __slots__ = ('payload',)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def to_json(self):
+        return self.payload
+
+
+class KeyboardCache:
+    # Markups are built outside the lock from the current catalog. A build
+    # that overlaps invalidate() may have read the old catalog, so it is
+    # returned but not stored.
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._markups = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        markup = self._markups.get(key)
+        if markup is not None:
+            self.hits += 1
+            return markup
+        generation = self._generation
+        markup = PreparedMarkup(build().to_json())
+        with self._lock:
+            self.misses += 1
+            if generation == self._generation:
+                self._markups[key] = markup
+        return markup
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._markups = {}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'size': len(self._markups),
+        }
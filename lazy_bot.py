@@ -0,0 +1,52 @@
+import threading
+
+
+class LazyBot:
+    # Stands in for the TeleBot until something needs it. Handlers registered
+    # before then are recorded and replayed on the real bot, so importing the
+    # views neither builds the client nor starts its worker threads.
+    def __init__(self, factory):
+        self._factory = factory
+        self._bot = None
+        self._handlers = []
+        self._lock = threading.Lock()
+
+    def message_handler(self, **filters):
+        return self._register('message_handler', filters)
+
+    def inline_handler(self, func, **filters):
+        return self._register('inline_handler', dict(filters, func=func))
+
+    def _register(self, kind, filters):
+        def decorator(handler):
+            with self._lock:
+                if self._bot is None:
+                    self._handlers.append((kind, filters, handler))
+                    return handler
+            getattr(self._bot, kind)(**filters)(handler)
+            return handler
+        return decorator
+
+    @property
+    def loaded(self):
+        return self._bot is not None
+
+    def get(self):
+        if self._bot is None:
+            with self._lock:
+                if self._bot is None:
+                    bot = self._factory()
+                    for kind, filters, handler in self._handlers:
+                        getattr(bot, kind)(**filters)(handler)
+                    self._handlers = []
+                    self._bot = bot
+        return self._bot
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.get(), name, value)
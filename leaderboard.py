@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from bot.alerts import UNHEALTHY_PM_BAND
+from bot.classifiers import BATCH_FIELDS, PM_LEVELS, MISSING, pm_bands, classify_columns
+
+LEADERBOARD_FIELDS = BATCH_FIELDS + ('wind_speed',)
+LEADERBOARD_SIZE = 10
+# /Ranking shows the first few stations of every board.
+PODIUM_SIZE = 3
+
+# descending: the station with the highest value comes first.
+Board = namedtuple('Board', ['key', 'title', 'field', 'descending'])
+BOARDS = {board.key: board for board in (
+    Board('hottest', 'Hottest', 'temperature', True),
+    Board('coldest', 'Coldest', 'temperature', False),
+    Board('cleanest', 'Cleanest air', 'pm2_5', False),
+    Board('polluted', 'Most polluted air', 'pm2_5', True),
+    Board('windiest', 'Windiest', 'wind_speed', True),
+    Board('sunniest', 'Highest UV', 'uv', True),
+)}
+RANKING_COMMANDS = {f'Ranking_{key}': board for key, board in BOARDS.items()}
+
+# temperature is (min, mean, max); values are NaN when no station in the region reports them.
+RegionSummary = namedtuple(
+    'RegionSummary',
+    ['region', 'stations', 'reporting', 'temperature', 'pm2_5', 'pm_level', 'unhealthy', 'wind_speed'],
+)
+LeaderboardState = namedtuple('LeaderboardState', ['locations', 'names', 'regions', 'columns', 'orders', 'summaries', 'texts'])
+
+
+def group_stats(groups, values, count):
+    # (min, mean, max) of values per group, ignoring NaN.
+    known = ~np.isnan(values)
+    totals = np.bincount(groups[known], weights=values[known], minlength=count)
+    sizes = np.bincount(groups[known], minlength=count)
+    means = np.divide(totals, sizes, out=np.full(count, np.nan), where=sizes > 0)
+    lows, highs = np.full(count, np.nan), np.full(count, np.nan)
+    np.fmin.at(lows, groups, values)
+    np.fmax.at(highs, groups, values)
+    return lows, means, highs
+
+
+class Leaderboard:
+    # Rankings and regional aggregates for the whole network. They are
+    # recomputed from the snapshot columns once per cycle (and after a
+    # catalog change), so a command only slices a sorted order. Rendered
+    # texts live in the cycle's state and go away with it.
+    def __init__(self, snapshot, catalog, renderer, excluded=lambda device_id: False):
+        self.snapshot = snapshot
+        self.catalog = catalog
+        self.renderer = renderer
+        self.excluded = excluded
+        self.rebuilds = 0
+        self.hits = 0
+        self.misses = 0
+        self.build_seconds = 0.0
+        self._state = None
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        started = time.perf_counter()
+        locations, device_ids = self.catalog()
+        device_names = {device_id: name for name, device_id in device_ids.items()}
+        region_of = {name: region for region, names in locations.items() for name in names}
+        ids, columns = self.snapshot.columns(LEADERBOARD_FIELDS)
+        # Stations the health check flags are left out; ties rank by name.
+        rows = sorted(
+            (device_names[device_id], row) for row, device_id in enumerate(ids)
+            if device_id in device_names and not self.excluded(device_id)
+        )
+        names = [name for name, _ in rows]
+        positions = np.array([row for _, row in rows], dtype=np.intp)
+        columns = {field: column[positions] for field, column in columns.items()}
+
+        orders = {}
+        for key, board in BOARDS.items():
+            values = columns[board.field]
+            known = np.flatnonzero(~np.isnan(values))
+            orders[key] = known[np.argsort(-values[known] if board.descending else values[known], kind='stable')]
+
+        regions = [region_of.get(name) for name in names]
+        state = LeaderboardState(locations, names, regions, columns, orders,
+                                 self._summarize(locations, regions, columns), {})
+        with self._lock:
+            self._state = state
+            self.rebuilds += 1
+            self.build_seconds = time.perf_counter() - started
+        return state
+
+    @staticmethod
+    def _summarize(locations, regions, columns):
+        region_names = list(locations)
+        index = {region: i for i, region in enumerate(region_names)}
+        groups = np.array([index.get(region, -1) for region in regions], dtype=np.intp)
+        known = groups >= 0
+        groups = groups[known]
+        columns = {field: column[known] for field, column in columns.items()}
+        count = len(region_names)
+
+        reporting = np.bincount(groups, minlength=count)
+        temperature = group_stats(groups, columns['temperature'], count)
+        pm2_5 = group_stats(groups, columns['pm2_5'], count)[1]
+        pm_levels = pm_bands(pm2_5, "PM2.5")
+        unhealthy = np.bincount(groups, weights=classify_columns(columns).pm2_5 >= UNHEALTHY_PM_BAND, minlength=count)
+        wind_speed = group_stats(groups, columns['wind_speed'], count)[2]
+        return [
+            RegionSummary(
+                region, len(locations[region]), int(reporting[i]),
+                (temperature[0][i], temperature[1][i], temperature[2][i]), pm2_5[i],
+                PM_LEVELS[pm_levels[i]] if pm_levels[i] != MISSING else None, int(unhealthy[i]), wind_speed[i],
+            )
+            for i, region in enumerate(region_names)
+        ]
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+
+    def _current(self):
+        state = self._state
+        if state is None or state.locations is not self.catalog()[0]:
+            state = self.rebuild()
+        return state
+
+    def top(self, key, limit=LEADERBOARD_SIZE, state=None):
+        # [(name, region, value)], best first.
+        state = state or self._current()
+        values = state.columns[BOARDS[key].field]
+        return [(state.names[i], state.regions[i], float(values[i])) for i in state.orders[key][:limit]]
+
+    def _text(self, key, build):
+        state = self._current()
+        text = state.texts.get(key)
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+        text = state.texts[key] = build(state)
+        return text
+
+    def ranking_text(self, command='Ranking'):
+        board = RANKING_COMMANDS.get(command)
+        if board is None:
+            keys, limit = list(BOARDS), PODIUM_SIZE
+        else:
+            keys, limit = [board.key], LEADERBOARD_SIZE
+        return self._text(('ranking', command), lambda state: self.renderer.render_leaderboard(
+            len(state.names),
+            [(BOARDS[key], self.top(key, limit, state)) for key in keys],
+            more=list(RANKING_COMMANDS) if board is None else (),
+        ))
+
+    def overview_text(self):
+        return self._text(('overview',), lambda state: self.renderer.render_overview(state.summaries))
+
+    def stats(self):
+        state = self._state
+        return {
+            'stations': len(state.names) if state is not None else 0,
+            'rebuilds': self.rebuilds,
+            'build_ms': round(self.build_seconds * 1000, 3),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
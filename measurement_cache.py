@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Stations report every quarter of an hour; give them a minute to upload
+# before treating the previous reading as outdated.
+REPORT_INTERVAL = 15 * 60
+REPORT_DELAY = 60
+
+
+def report_bucket(now=None, interval=REPORT_INTERVAL, delay=REPORT_DELAY):
+    if now is None:
+        now = time.time()
+    return int((now - delay) // interval)
+
+
+class _Call:
+    __slots__ = ('event', 'result')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class MeasurementCache:
+    def __init__(self, max_entries=512, interval=REPORT_INTERVAL, delay=REPORT_DELAY, clock=time.time):
+        self.max_entries = max_entries
+        self.interval = interval
+        self.delay = delay
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self):
+        return report_bucket(self.clock(), self.interval, self.delay)
+
+    def _fresh(self, device_id, bucket):
+        entry = self._entries.get(device_id)
+        if entry is not None and entry[0] == bucket:
+            self._entries.move_to_end(device_id)
+            self.hits += 1
+            return entry[1]
+        return None
+
+    def lookup(self, device_id):
+        with self._lock:
+            measurement = self._fresh(device_id, self._bucket())
+            if measurement is None:
+                self.misses += 1
+            return measurement
+
+    def last(self, device_id):
+        # The latest reading whatever its bucket, and when it was stored.
+        with self._lock:
+            entry = self._entries.get(device_id)
+        return (entry[1], entry[2]) if entry is not None else (None, None)
+
+    def fresh(self, device_id):
+        # Like lookup, without touching the stats or the LRU order.
+        bucket = self._bucket()
+        with self._lock:
+            entry = self._entries.get(device_id)
+        return entry is not None and entry[0] == bucket
+
+    def get(self, device_id, fetch):
+        bucket = self._bucket()
+        with self._lock:
+            measurement = self._fresh(device_id, bucket)
+            if measurement is not None:
+                return measurement
+            call = self._in_flight.get(device_id)
+            if call is None:
+                leader = True
+                self.misses += 1
+                call = self._in_flight[device_id] = _Call()
+            else:
+                leader = False
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            return call.result
+
+        try:
+            call.result = fetch(device_id)
+        finally:
+            with self._lock:
+                del self._in_flight[device_id]
+                if call.result is not None:
+                    self._store(device_id, bucket, call.result)
+            call.event.set()
+        return call.result
+
+    def put(self, device_id, measurement):
+        with self._lock:
+            self._store(device_id, self._bucket(), measurement)
+
+    def _store(self, device_id, bucket, measurement):
+        self._entries[device_id] = (bucket, measurement, self.clock())
+        self._entries.move_to_end(device_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, device_id=None):
+        with self._lock:
+            if device_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(device_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                'size': len(self._entries),
+            }
@@ -0,0 +1,249 @@
+import asyncio
+import bisect
+import itertools
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Unset or 0 leaves the profiler off.
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HANDLER_METRIC = 'bot_handler_seconds'
+PREFIX = 'bot_'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+    def quantile(self, q, cumulative=None):
+        # Upper bound of the bucket holding the q-th observation.
+        if cumulative is None:
+            cumulative, _ = self.snapshot()
+        if not cumulative[-1]:
+            return None
+        index = bisect.bisect_left(cumulative, q * cumulative[-1])
+        return self.buckets[index] if index < len(self.buckets) else float('inf')
+
+
+class SlowUpdateProfiler:
+    # Every update registers under its own token, with the thread it runs on
+    # or, under the async engine, its task. A sampler thread takes the stack
+    # of every update that has been running for longer than the threshold,
+    # so only slow updates are profiled and fast ones cost a dict insert and
+    # delete.
+    def __init__(self, threshold, interval=PROFILE_INTERVAL_MS / 1000, max_depth=40, max_stacks=5000):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.slow = Counter()
+        self._stacks = Counter()
+        self._active = {}
+        self._tokens = itertools.count()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(target=self._run, name='slow-update-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def enter(self, name):
+        self.start()
+        token = next(self._tokens)
+        self._active[token] = (name, time.perf_counter(), threading.get_ident(), current_task())
+        return token
+
+    def exit(self, token):
+        entry = self._active.pop(token, None)
+        if entry is not None and time.perf_counter() - entry[1] >= self.threshold:
+            with self._lock:
+                self.slow[entry[0]] += 1
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            slow = [entry for entry in list(self._active.values()) if now - entry[1] >= self.threshold]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for name, _, ident, task in slow:
+                    # Updates sharing the event loop thread are told apart by their task's stack.
+                    if task is not None:
+                        entries = traceback.StackSummary.extract(
+                            (frame, frame.f_lineno) for frame in task.get_stack(limit=self.max_depth)
+                        )
+                    elif ident in frames:
+                        entries = traceback.extract_stack(frames[ident], limit=self.max_depth)
+                    else:
+                        continue
+                    key = (name, self._collapse(entries))
+                    if key in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[key] += 1
+
+    @staticmethod
+    def _collapse(entries):
+        return ';'.join(f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})" for entry in entries)
+
+    def report(self, top=20):
+        with self._lock:
+            return {
+                'slow_updates': dict(self.slow),
+                'stacks': [
+                    {'handler': name, 'samples': samples, 'stack': stack}
+                    for (name, stack), samples in self._stacks.most_common(top)
+                ],
+            }
+
+    def reset(self):
+        with self._lock:
+            self.slow.clear()
+            self._stacks.clear()
+
+
+def current_task():
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+class MetricsRegistry:
+    # Latencies are histograms observed on the hot path. Everything else is
+    # read at scrape time from collectors, which return the stats() dicts the
+    # components already keep.
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self._histograms = {}
+        self._errors = Counter()
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    @contextmanager
+    def track(self, handler):
+        histogram = self.histogram(HANDLER_METRIC, handler=handler)
+        token = self.profiler.enter(handler) if self.profiler is not None else None
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self._errors[handler] += 1
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            if token is not None:
+                self.profiler.exit(token)
+
+    def register(self, name, collect, label=None):
+        # collect() returns {stat: number}, or {label value: {stat: number}} when label is given.
+        self._collectors[name] = (collect, label)
+
+    def _collect(self):
+        results = {}
+        for name, (collect, label) in list(self._collectors.items()):
+            try:
+                results[name] = (collect(), label)
+            except Exception as e:
+                print(f"Error collecting metrics for {name}: {e}")
+        return results
+
+    def as_dict(self):
+        histograms = {}
+        for (name, labels), histogram in list(self._histograms.items()):
+            handler = dict(labels).get('handler', '')
+            cumulative, total = histogram.snapshot()
+            count = cumulative[-1]
+            entry = {
+                'count': count,
+                'errors': self._errors.get(handler, 0),
+                'mean_ms': 1000 * total / count if count else None,
+            }
+            # Observations past the last bucket report an infinite bound.
+            for q in (0.5, 0.9, 0.99):
+                bound = histogram.quantile(q, cumulative)
+                entry[f"p{int(q * 100)}_ms_le"] = bound if bound in (None, float('inf')) else 1000 * bound
+            histograms.setdefault(name, {})[handler] = entry
+        data = {'histograms': histograms}
+        data.update({name: stats for name, (stats, _) in self._collect().items()})
+        if self.profiler is not None:
+            data['profile'] = self.profiler.report()
+        return data
+
+    def as_prometheus(self):
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name, series in by_name.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series:
+                cumulative, total = histogram.snapshot()
+                for bound, count in zip(histogram.buckets + (float('inf'),), cumulative):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative[-1]}")
+        if self._errors:
+            lines.append(f"# TYPE {PREFIX}handler_errors_total counter")
+            for handler, count in sorted(self._errors.items()):
+                lines.append(f"{PREFIX}handler_errors_total{_labels((('handler', handler),))} {count}")
+        for name, (stats, label) in self._collect().items():
+            rows = stats.items() if label is not None else [(None, stats)]
+            for value, values in rows:
+                for stat, number in values.items():
+                    if isinstance(number, bool) or not isinstance(number, (int, float)):
+                        continue
+                    labels = ((label, value),) if label is not None else ()
+                    lines.append(f"{PREFIX}{name}_{stat}{_labels(labels)} {number}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
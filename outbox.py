@@ -0,0 +1,258 @@
+import heapq
+import html
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from telebot.apihelper import ApiTelegramException
+
+load_dotenv()
+
+# Telegram allows about 30 messages a second overall, one a second per
+# private chat and 20 a minute per group. Stay a little below that.
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '25'))
+OUTBOX_CHAT_RATE = float(os.getenv('OUTBOX_CHAT_RATE', '1'))
+OUTBOX_CHAT_BURST = float(os.getenv('OUTBOX_CHAT_BURST', '3'))
+OUTBOX_GROUP_RATE = float(os.getenv('OUTBOX_GROUP_RATE', str(20 / 60)))
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '8'))
+OUTBOX_MAX_PENDING = int(os.getenv('OUTBOX_MAX_PENDING', '10000'))
+
+INTERACTIVE = 0
+BROADCAST = 1
+
+MESSAGE_LIMIT = 4096
+MERGE_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class Outgoing:
+    __slots__ = ('method', 'chat_id', 'payload', 'kwargs', 'priority')
+
+    def __init__(self, method, chat_id, payload, kwargs, priority):
+        self.method = method
+        self.chat_id = chat_id
+        self.payload = payload
+        self.kwargs = kwargs
+        self.priority = priority
+
+    def merge(self, other):
+        # Consecutive texts to one chat are sent as a single message when the
+        # second one would not replace the first one's keyboard.
+        if self.method != 'send_message' or other.method != 'send_message':
+            return None
+        if other.kwargs.get('reply_markup') is not None:
+            return None
+        mode, other_mode = self.kwargs.get('parse_mode'), other.kwargs.get('parse_mode')
+        rest = {key: value for key, value in self.kwargs.items() if key not in ('reply_markup', 'parse_mode')}
+        other_rest = {key: value for key, value in other.kwargs.items() if key not in ('reply_markup', 'parse_mode')}
+        if rest != other_rest:
+            return None
+        text = other.payload
+        if mode != other_mode:
+            if mode != 'HTML' or other_mode is not None:
+                return None
+            text = html.escape(text, quote=False)
+        merged = self.payload + MERGE_SEPARATOR + text
+        if len(merged) > MESSAGE_LIMIT:
+            return None
+        return Outgoing(self.method, self.chat_id, merged, self.kwargs, min(self.priority, other.priority))
+
+
+class Outbox:
+    # Messages wait in a per-chat queue. A chat is scheduled on one of two
+    # heaps (interactive before broadcast) once its own bucket allows it, and
+    # the dispatcher hands it to a sender thread once the global bucket does.
+    # A chat has at most one message in flight, which keeps its messages in
+    # order and gives later ones a chance to be merged. Telegram's flood wait
+    # applies to the whole bot, so a 429 pauses every chat for retry_after.
+    def __init__(self, bot, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE,
+                 chat_burst=OUTBOX_CHAT_BURST, group_rate=OUTBOX_GROUP_RATE, workers=OUTBOX_WORKERS,
+                 max_pending=OUTBOX_MAX_PENDING, clock=time.monotonic):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.workers = workers
+        self.max_pending = max_pending
+        self.clock = clock
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._paused_until = 0.0
+        self._buckets = {}
+        self._pending = {}
+        self._size = 0
+        self._busy = set()
+        self._heaps = ([], [])
+        self._order = itertools.count()
+        self._executor = None
+        self._condition = threading.Condition()
+
+    def start(self):
+        with self._condition:
+            if self._executor is not None:
+                return False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='outbox')
+            threading.Thread(target=self._dispatch, name='outbox-dispatcher', daemon=True).start()
+            return True
+
+    def send_message(self, chat_id, text, priority=INTERACTIVE, **kwargs):
+        return self._enqueue(Outgoing('send_message', chat_id, text, kwargs, priority))
+
+    def send_photo(self, chat_id, photo, priority=INTERACTIVE, **kwargs):
+        return self._enqueue(Outgoing('send_photo', chat_id, photo, kwargs, priority))
+
+    def send_many(self, chat_ids, text, priority=BROADCAST, **kwargs):
+        # Fan-out under a single lock acquisition; every chat shares the text and kwargs.
+        self.start()
+        with self._condition:
+            now = self.clock()
+            return sum(self._push(Outgoing('send_message', chat_id, text, kwargs, priority), now)
+                       for chat_id in chat_ids)
+
+    def pending(self):
+        with self._condition:
+            return self._size
+
+    def _enqueue(self, item):
+        self.start()
+        with self._condition:
+            return self._push(item, self.clock())
+
+    def _push(self, item, now):
+        if item.priority != INTERACTIVE and self._size >= self.max_pending:
+            self.dropped += 1
+            return False
+        self._pending.setdefault(item.chat_id, deque()).append(item)
+        self._size += 1
+        if item.chat_id not in self._busy:
+            self._busy.add(item.chat_id)
+            self._schedule(item.chat_id, now)
+        return True
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= 4 * self.max_pending:
+                # Full buckets carry no state worth keeping.
+                for idle in [key for key, value in self._buckets.items() if value.full(now)]:
+                    del self._buckets[idle]
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.chat_burst, now)
+        return bucket
+
+    def _schedule(self, chat_id, now, not_before=0.0):
+        # Called with the condition held, for a busy chat with pending messages.
+        ready_at = max(now + self._bucket(chat_id, now).delay(now), not_before)
+        priority = self._pending[chat_id][0].priority
+        heapq.heappush(self._heaps[priority], (ready_at, next(self._order), chat_id))
+        self._condition.notify()
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                item = self._next()
+            self._executor.submit(self._deliver, item)
+
+    def _next(self):
+        while True:
+            now = self.clock()
+            if now < self._paused_until:
+                self._condition.wait(self._paused_until - now)
+                continue
+            wake = None
+            for heap in self._heaps:
+                if heap and heap[0][0] <= now:
+                    wait = self._global.delay(now)
+                    if wait:
+                        wake = now + wait
+                        break
+                    _, _, chat_id = heapq.heappop(heap)
+                    self._global.take(now)
+                    self._bucket(chat_id, now).take(now)
+                    return self._take(chat_id)
+                if heap and (wake is None or heap[0][0] < wake):
+                    wake = heap[0][0]
+            self._condition.wait(None if wake is None else max(0.0, wake - now))
+
+    def _take(self, chat_id):
+        queue = self._pending[chat_id]
+        item = queue.popleft()
+        while queue:
+            merged = item.merge(queue[0])
+            if merged is None:
+                break
+            queue.popleft()
+            item = merged
+            self.merged += 1
+            self._size -= 1
+        self._size -= 1
+        return item
+
+    def _deliver(self, item):
+        sent, retry_after = False, 0.0
+        try:
+            getattr(self.bot, item.method)(item.chat_id, item.payload, **item.kwargs)
+            sent = True
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = float((e.result_json or {}).get('parameters', {}).get('retry_after', 1))
+            else:
+                print(f"Error sending to {item.chat_id}: {e}")
+        except Exception as e:
+            print(f"Error sending to {item.chat_id}: {e}")
+        with self._condition:
+            now = self.clock()
+            self.sent += sent
+            if retry_after:
+                self.rate_limited += 1
+                self._paused_until = max(self._paused_until, now + retry_after)
+                self._pending.setdefault(item.chat_id, deque()).appendleft(item)
+                self._size += 1
+            queue = self._pending.get(item.chat_id)
+            if queue:
+                self._schedule(item.chat_id, now, now + retry_after)
+            else:
+                self._pending.pop(item.chat_id, None)
+                self._busy.discard(item.chat_id)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': self._size,
+                'sent': self.sent,
+                'merged': self.merged,
+                'dropped': self.dropped,
+                'rate_limited': self.rate_limited,
+            }
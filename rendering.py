@@ -0,0 +1,377 @@
+import math
+import threading
+from html import escape
+from collections import OrderedDict, namedtuple
+from functools import partial
+
+from bot.classifiers import uv_index, pm_level, detect_weather_condition
+
+MISSING = "N/A"
+# The single-device reply shows a missing reading as "NA" followed by its unit.
+SINGLE_MISSING = "NA"
+
+# better: which direction wins a comparison ('higher', 'lower', or None for
+# values that are only shown side by side). short, summary and leader opt a
+# metric into the ranking table, the two-device summary and the ranking summary.
+MetricSpec = namedtuple(
+    'MetricSpec',
+    ['field', 'label', 'emoji', 'suffix', 'classifier', 'better', 'compare_desc', 'is_round', 'short', 'summary', 'leader'],
+    defaults=(None, 'higher', None, False, None, None, None),
+)
+
+SECTIONS = (
+    ("<b> 𝗟𝗶𝗴𝗵𝘁 𝗮𝗻𝗱 𝗨𝗩 𝗜𝗻𝗳𝗼𝗿𝗺𝗮𝘁𝗶𝗼𝗻</b>", (
+        MetricSpec('uv', 'UV Index', '☀️', '', classifier=uv_index, compare_desc='sunnier',
+                   short='UV', summary='is sunnier', leader='is the sunniest'),
+        MetricSpec('lux', 'Light Intensity', '🔆', ' lux', compare_desc='brighter'),
+    )),
+    ("<b> 𝗘𝗻𝘃𝗶𝗿𝗼𝗻𝗺𝗲𝗻𝘁𝗮𝗹 𝗖𝗼𝗻𝗱𝗶𝘁𝗶𝗼𝗻𝘀</b>", (
+        MetricSpec('temperature', 'Temperature', '🌡️', '°C', compare_desc='warmer', is_round=True,
+                   short='T°C', summary='is warmer', leader='is the warmest'),
+        MetricSpec('pressure', 'Atmospheric Pressure', '⏲️', ' hPa', compare_desc='higher'),
+        MetricSpec('humidity', 'Humidity', '💧', '%', compare_desc='more humid', short='Hum%'),
+    )),
+    ("<b> 𝗔𝗶𝗿 𝗤𝘂𝗮𝗹𝗶𝘁𝘆 𝗟𝗲𝘃𝗲𝗹𝘀</b>", (
+        MetricSpec('pm1', 'PM1.0', '🫁', ' µg/m³', classifier=partial(pm_level, pollutant="PM1.0"),
+                   better='lower', compare_desc='cleaner'),
+        MetricSpec('pm2_5', 'PM2.5', '💨', ' µg/m³', classifier=partial(pm_level, pollutant="PM2.5"),
+                   better='lower', compare_desc='cleaner', short='PM2.5', summary='has cleaner air',
+                   leader='has the cleanest air'),
+        MetricSpec('pm10', 'PM10', '🌫️', ' µg/m³', classifier=partial(pm_level, pollutant="PM10"),
+                   better='lower', compare_desc='cleaner'),
+    )),
+    ("<b>𝗪𝗲𝗮𝘁𝗵𝗲𝗿 𝗖𝗼𝗻𝗱𝗶𝘁𝗶𝗼𝗻</b>", (
+        MetricSpec('wind_speed', 'Wind Speed', '🌪️', ' m/s', compare_desc='windier', short='Wind',
+                   leader='is the windiest'),
+        MetricSpec('rain', 'Rainfall', '🌧️', ' mm', compare_desc='wetter', leader='is the wettest'),
+        MetricSpec('wind_direction', 'Wind Direction', '🧭', '', better=None),
+    )),
+)
+RANK_FIELD = 'temperature'
+SUMMARY_ORDER = ('temperature', 'uv', 'pm2_5')
+HISTORY_FIELDS = ('temperature', 'humidity', 'pressure', 'pm2_5', 'uv', 'wind_speed', 'rain')
+SPARK_BLOCKS = "▁▂▃▄▅▆▇█"
+NEARBY_FIELDS = ('temperature', 'pm2_5')
+
+
+def display_value(value, is_round=False):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return round(value) if is_round else value
+
+
+def value_text(value, suffix=''):
+    return MISSING if value is None else f"{value}{suffix}"
+
+
+def single_text(value, suffix=''):
+    return f"{SINGLE_MISSING if value is None else value}{suffix}"
+
+
+def winner(spec, value1, value2):
+    # Returns 1 or 2 for the better device, 0 for a tie and None when either value is missing.
+    if value1 is None or value2 is None:
+        return None
+    value1, value2 = float(value1), float(value2)
+    if value1 == value2:
+        return 0
+    if (value1 > value2) == (spec.better == 'higher'):
+        return 1
+    return 2
+
+
+def present(values):
+    return [value for value in values if not math.isnan(value)]
+
+
+def sparkline(values):
+    # Missing buckets are drawn as gaps.
+    known = present(values)
+    if not known:
+        return ""
+    low, high = min(known), max(known)
+    scale = (len(SPARK_BLOCKS) - 1) / (high - low) if high > low else 0
+    return "".join(" " if math.isnan(value) else SPARK_BLOCKS[round((value - low) * scale)] for value in values)
+
+
+def history_value(spec, value):
+    return value_text(round(value) if spec.is_round else f"{round(value, 1):g}", spec.suffix)
+
+
+class LRUCache:
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries),
+        }
+
+
+class Renderer:
+    def __init__(self, sections=SECTIONS, cache_size=2048):
+        # Everything that does not depend on the measurement is formatted once here.
+        self.sections = tuple(
+            (title + "\n", tuple((spec, f"{spec.emoji} <b>{spec.label}:</b> ") for spec in specs))
+            for title, specs in sections
+        )
+        specs = [spec for _, compiled in self.sections for spec, _ in compiled]
+        self.summary_specs = tuple(sorted(
+            (spec for spec in specs if spec.summary), key=lambda spec: SUMMARY_ORDER.index(spec.field)
+        ))
+        self.column_specs = tuple(spec for spec in specs if spec.short)
+        self.leader_specs = tuple(spec for spec in specs if spec.leader)
+        self.rank_spec = next(spec for spec in specs if spec.field == RANK_FIELD)
+        self.history_specs = tuple(next(spec for spec in specs if spec.field == field) for field in HISTORY_FIELDS)
+        self.nearby_specs = tuple(next(spec for spec in specs if spec.field == field) for field in NEARBY_FIELDS)
+        self.field_specs = {spec.field: spec for spec in specs}
+        self.single_cache = LRUCache(cache_size)
+        self.comparison_cache = LRUCache(cache_size)
+        self.compact_cache = LRUCache(cache_size)
+
+    def render(self, device, measurement):
+        key = (device, measurement.get('timestamp'))
+        return self.single_cache.get(key, lambda: self._render(device, measurement))
+
+    def render_comparison(self, device1, measurement1, device2, measurement2):
+        key = (device1, measurement1.get('timestamp'), device2, measurement2.get('timestamp'))
+        return self.comparison_cache.get(
+            key, lambda: self._render_comparison(device1, measurement1, device2, measurement2)
+        )
+
+    def _render(self, device, measurement):
+        parts = [
+            f"<b>𝗟𝗮𝘁𝗲𝘀𝘁 𝗠𝗲𝗮𝘀𝘂𝗿𝗲𝗺𝗲𝗻𝘁</b>\n"
+            f"🔹 <b>Device:</b> <b>{escape(device)}</b>\n"
+            f"🔹 <b>Timestamp:</b> {single_text(display_value(measurement.get('timestamp')))}\n\n"
+        ]
+        for title, compiled in self.sections:
+            parts.append(title)
+            for spec, prefix in compiled:
+                raw = measurement.get(spec.field)
+                line = prefix + single_text(display_value(raw, spec.is_round), spec.suffix)
+                if spec.classifier is not None:
+                    line += f" ({spec.classifier(raw)})"
+                parts.append(line + "\n")
+            parts.append("\n")
+        parts.append(f"🔍 <b>Detected Weather Condition:</b> {detect_weather_condition(measurement, for_comparison=False)}\n")
+        return "".join(parts)
+
+    def _render_comparison(self, device1, measurement1, device2, measurement2):
+        names = (None, escape(device1), escape(device2))
+        parts = [
+            f"<b>𝗪𝗲𝗮𝘁𝗵𝗲𝗿 𝗖𝗼𝗺𝗽𝗮𝗿𝗶𝘀𝗼𝗻</b>\n"
+            f"🔹 <b>Devices:</b> <b>{names[1]}</b> vs <b>{names[2]}</b>\n"
+            f"🔹 <b>Timestamp:</b> {measurement1.get('timestamp')}\n\n"
+        ]
+        for i, (title, compiled) in enumerate(self.sections):
+            if i:
+                parts.append("\n")
+            parts.append(title)
+            for spec, prefix in compiled:
+                raw1, raw2 = measurement1.get(spec.field), measurement2.get(spec.field)
+                value1, value2 = display_value(raw1, spec.is_round), display_value(raw2, spec.is_round)
+                line = prefix + f"{value_text(value1, spec.suffix)} vs {value_text(value2, spec.suffix)}"
+                if spec.better is not None:
+                    result = winner(spec, value1, value2)
+                    if result is None:
+                        line += f" ({MISSING})"
+                    elif result == 0:
+                        line += " (Equal)"
+                    else:
+                        line += f" ({names[result]} is {spec.compare_desc})"
+                if spec.classifier is not None:
+                    line += f" ({spec.classifier(raw1)} vs {spec.classifier(raw2)})"
+                parts.append(line + "\n")
+
+        weather1 = detect_weather_condition(measurement1, for_comparison=True)
+        weather2 = detect_weather_condition(measurement2, for_comparison=True)
+        if weather1 or weather2:
+            parts.append(f"🔍 <b>Detected Weather Condition:</b> {weather1} vs {weather2}\n")
+
+        summary = []
+        for spec in self.summary_specs:
+            result = winner(
+                spec,
+                display_value(measurement1.get(spec.field), spec.is_round),
+                display_value(measurement2.get(spec.field), spec.is_round),
+            )
+            if result:
+                summary.append(f"{names[result]} {spec.summary}")
+        parts.append(f"\n🔹 <b>Summary:</b> {', '.join(summary) or 'Conditions are similar!'}\n")
+        return "".join(parts)
+
+    def render_ranking(self, devices):
+        available = [(name, data) for name, data in devices if data]
+        unavailable = [name for name, data in devices if not data]
+
+        rows = [
+            (name, [display_value(data.get(spec.field), spec.is_round) for spec in self.column_specs])
+            for name, data in available
+        ]
+        rank_column = self.column_specs.index(self.rank_spec)
+        sign = -1 if self.rank_spec.better == 'higher' else 1
+        rows.sort(key=lambda row: (row[1][rank_column] is None, sign * (row[1][rank_column] or 0)))
+
+        name_width = min(14, max(len(name) for name, _ in rows))
+        widths = [
+            max(len(spec.short), *(len(value_text(values[i])) for _, values in rows))
+            for i, spec in enumerate(self.column_specs)
+        ]
+        lines = ["#  " + "Device".ljust(name_width)
+                 + "".join(" " + spec.short.rjust(width) for spec, width in zip(self.column_specs, widths))]
+        for rank, (name, values) in enumerate(rows, start=1):
+            lines.append(
+                f"{rank:<2} " + escape(name[:name_width].ljust(name_width))
+                + "".join(" " + value_text(value).rjust(width) for value, width in zip(values, widths))
+            )
+
+        summary = []
+        for spec in self.leader_specs:
+            candidates = [(display_value(data.get(spec.field)), name) for name, data in available]
+            candidates = [(value, name) for value, name in candidates if value is not None]
+            if len(candidates) < 2 or len({value for value, _ in candidates}) == 1:
+                continue
+            pick = max if spec.better == 'higher' else min
+            summary.append(f"{escape(pick(candidates, key=lambda candidate: candidate[0])[1])} {spec.leader}")
+        summary_text = f"🔹 <b>Summary:</b> {', '.join(summary) or 'Conditions are similar!'}\n"
+        unavailable_text = f"⚠️ No data for: {escape(', '.join(unavailable))}\n" if unavailable else ""
+
+        table = "\n".join(lines)
+        return (
+            f"<b>𝗪𝗲𝗮𝘁𝗵𝗲𝗿 𝗖𝗼𝗺𝗽𝗮𝗿𝗶𝘀𝗼𝗻</b>\n"
+            f"🔹 <b>Devices:</b> {len(devices)}, ranked by {self.rank_spec.label.lower()}\n\n"
+            f"<pre>{table}</pre>\n\n"
+            f"{summary_text}"
+            f"{unavailable_text}"
+        )
+
+    def render_history(self, device, period, until, summary):
+        # summary maps a field to the (min, mean, max) bucket series from HistoryStore.downsample.
+        parts = [
+            f"<b>𝗛𝗶𝘀𝘁𝗼𝗿𝘆</b>\n"
+            f"🔹 <b>Device:</b> <b>{escape(device)}</b>\n"
+            f"🔹 <b>Period:</b> {period} up to {until}\n"
+        ]
+        for spec in self.history_specs:
+            if spec.field not in summary:
+                continue
+            lows, means, highs = summary[spec.field]
+            known_lows, known_means, known_highs = present(lows), present(means), present(highs)
+            if not known_means:
+                continue
+            low, high = history_value(spec, min(known_lows)), history_value(spec, max(known_highs))
+            average = history_value(spec, sum(known_means) / len(known_means))
+            span = low if low == high else f"{low} – {high}, avg {average}"
+            parts.append(f"\n{spec.emoji} <b>{spec.label}:</b> {span}\n<code>{sparkline(means)}</code>\n")
+        if len(parts) == 1:
+            parts.append("\nNo recorded data for this period.\n")
+        return "".join(parts)
+
+    def render_nearby(self, stations):
+        # stations: (name, distance in km, measurement or None), nearest first.
+        parts = ["<b>𝗡𝗲𝗮𝗿𝗲𝘀𝘁 𝗦𝘁𝗮𝘁𝗶𝗼𝗻𝘀</b>\n"]
+        for rank, (name, distance, measurement) in enumerate(stations, start=1):
+            distance_text = f"{distance:.1f}" if distance < 10 else f"{distance:.0f}"
+            parts.append(f"\n{rank}. <b>{escape(name)}</b>, {distance_text} km\n")
+            if not measurement:
+                parts.append("No recent data\n")
+                continue
+            parts.append("  ".join(self._readings(measurement)) + "\n")
+        return "".join(parts)
+
+    def render_leaderboard(self, stations, boards, more=()):
+        # boards: (Board, [(name, region, value)]) from Leaderboard.top.
+        if not stations:
+            return "⚠️ No station has reported yet. Check back after the next measurement."
+        parts = [
+            f"<b>𝗦𝘁𝗮𝘁𝗶𝗼𝗻 𝗥𝗮𝗻𝗸𝗶𝗻𝗴</b>\n"
+            f"🔹 <b>Stations:</b> {stations} reporting\n"
+        ]
+        for board, rows in boards:
+            spec = self.field_specs[board.field]
+            parts.append(f"\n{spec.emoji} <b>{board.title}</b>\n")
+            for rank, (name, region, value) in enumerate(rows, start=1):
+                parts.append(f"{rank}. <b>{escape(name)}</b> ({escape(str(region))}), {history_value(spec, value)}\n")
+            if not rows:
+                parts.append("No data\n")
+        if more:
+            parts.append("\nFull lists: " + " ".join(f"/{command}" for command in more) + "\n")
+        return "".join(parts)
+
+    def render_overview(self, summaries):
+        # summaries: RegionSummary per region, in catalog order.
+        reporting = sum(summary.reporting for summary in summaries)
+        parts = [
+            f"<b>𝗡𝗲𝘁𝘄𝗼𝗿𝗸 𝗢𝘃𝗲𝗿𝘃𝗶𝗲𝘄</b>\n"
+            f"🔹 <b>Stations reporting:</b> {reporting} of {sum(summary.stations for summary in summaries)}\n"
+        ]
+        temperature, pm2_5, wind_speed = (self.field_specs[field] for field in ('temperature', 'pm2_5', 'wind_speed'))
+        for summary in summaries:
+            parts.append(f"\n📍 <b>{escape(summary.region)}</b> · {summary.reporting} of {summary.stations} stations\n")
+            readings = []
+            low, mean, high = summary.temperature
+            if not math.isnan(mean):
+                span = "" if low == high else f" ({history_value(temperature, low)} – {history_value(temperature, high)})"
+                readings.append(f"{temperature.emoji} {history_value(temperature, mean)}{span}")
+            if not math.isnan(summary.pm2_5):
+                readings.append(f"{pm2_5.emoji} {pm2_5.label} {history_value(pm2_5, summary.pm2_5)} ({summary.pm_level})")
+            if not math.isnan(summary.wind_speed):
+                readings.append(f"{wind_speed.emoji} up to {history_value(wind_speed, summary.wind_speed)}")
+            parts.append("  ".join(readings) + "\n" if readings else "No recent data\n")
+            if summary.unhealthy:
+                plural = "" if summary.unhealthy == 1 else "s"
+                parts.append(f"⚠️ Unhealthy air at {summary.unhealthy} station{plural}\n")
+        return "".join(parts)
+
+    def _readings(self, measurement):
+        readings = []
+        for spec in self.nearby_specs:
+            raw = measurement.get(spec.field)
+            reading = f"{spec.emoji} {spec.label} {value_text(display_value(raw, spec.is_round), spec.suffix)}"
+            if spec.classifier is not None and raw is not None:
+                reading += f" ({spec.classifier(raw)})"
+            readings.append(reading)
+        return readings
+
+    def render_compact(self, device, measurement):
+        # One plain-text line, used as the description of an inline search result.
+        key = (device, measurement.get('timestamp'))
+        return self.compact_cache.get(key, lambda: self._render_compact(measurement))
+
+    def _render_compact(self, measurement):
+        readings = self._readings(measurement)
+        timestamp = measurement.get('timestamp')
+        if timestamp:
+            readings.append(f"🕒 {timestamp[:16]}")
+        return " · ".join(readings)
+
+    def stats(self):
+        return {
+            'single': self.single_cache.stats(),
+            'comparison': self.comparison_cache.stats(),
+            'compact': self.compact_cache.stats(),
+        }
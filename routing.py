@@ -0,0 +1,29 @@
+COUNTRY = 'country'
+DEVICE = 'device'
+
+
+class RoutingIndex:
+    def __init__(self, locations=None, device_ids=None):
+        self._routes = {}
+        if locations is not None:
+            self.rebuild(locations, device_ids or {})
+
+    def rebuild(self, locations, device_ids):
+        routes = {}
+        for devices in locations.values():
+            for device in devices:
+                routes[device] = (DEVICE, device_ids.get(device))
+        # Country handlers were registered first, so a name clash resolves to the country.
+        for country in locations:
+            routes[country] = (COUNTRY, country)
+        self._routes = routes
+
+    def route(self, text):
+        return self._routes.get(text)
+
+    def kind(self, text):
+        route = self._routes.get(text)
+        return route[0] if route is not None else None
+
+    def __len__(self):
+        return len(self._routes)
@@ -0,0 +1,103 @@
+import unicodedata
+from collections import namedtuple
+
+import numpy as np
+
+from bot.routing import COUNTRY, DEVICE
+
+FUZZY_MIN_SIMILARITY = 0.25
+
+SearchResult = namedtuple('SearchResult', ['kind', 'name', 'device_id'])
+
+
+def normalize(text):
+    # Case and accents are ignored, as are repeated spaces.
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return " ".join("".join(char for char in text if not unicodedata.combining(char)).split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    # Names are numbered shortest first, so every posting list is already in
+    # rank order and a query only reads as many ids as it returns. Each trie
+    # node keeps the ids below it. Whole-name prefixes rank above word
+    # prefixes ("Gav" -> "Gavar" before "Lake Gavaraghbyur"). When no name
+    # starts with the query, trigram similarity catches typos ("Gavr").
+    def __init__(self, locations=None, device_ids=None):
+        self.rebuild(locations or {}, device_ids or {})
+
+    def rebuild(self, locations, device_ids):
+        entries = {}
+        for country, devices in locations.items():
+            for device in devices:
+                entries[device] = SearchResult(DEVICE, device, device_ids.get(device))
+        # Like the router, a region shadows a device with the same name.
+        for country in locations:
+            entries[country] = SearchResult(COUNTRY, country, None)
+        ordered = sorted(entries.values(), key=lambda entry: (len(entry.name), normalize(entry.name)))
+        names, words, grams, sizes = {}, {}, {}, []
+        for entry_id, entry in enumerate(ordered):
+            normalized = normalize(entry.name)
+            self._insert(names, normalized, entry_id)
+            position = normalized.find(" ")
+            while position != -1:
+                self._insert(words, normalized[position + 1:], entry_id)
+                position = normalized.find(" ", position + 1)
+            entry_grams = trigrams(normalized)
+            for gram in entry_grams:
+                grams.setdefault(gram, []).append(entry_id)
+            sizes.append(len(entry_grams))
+        grams = {gram: np.array(ids, dtype=np.int32) for gram, ids in grams.items()}
+        # Swap everything in one assignment so a concurrent query sees one catalog.
+        self._index = (ordered, names, words, grams, np.array(sizes, dtype=np.float64))
+
+    @staticmethod
+    def _insert(trie, text, entry_id):
+        node = trie
+        for char in text:
+            node = node.setdefault(char, {})
+            ids = node.setdefault('', [])
+            if not ids or ids[-1] != entry_id:
+                ids.append(entry_id)
+
+    @staticmethod
+    def _prefixed(trie, prefix):
+        node = trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return ()
+        return node.get('', ())
+
+    def search(self, query, limit=10):
+        entries, names, words, grams, sizes = self._index
+        query = normalize(query)
+        if not query:
+            return [entry for entry in entries if entry.kind == COUNTRY][:limit]
+        found, seen = [], set()
+        for trie in (names, words):
+            for entry_id in self._prefixed(trie, query):
+                if entry_id not in seen:
+                    seen.add(entry_id)
+                    found.append(entries[entry_id])
+                    if len(found) == limit:
+                        return found
+        if found:
+            return found
+        query_grams = trigrams(query)
+        postings = [grams[gram] for gram in query_grams if gram in grams]
+        if not postings:
+            return []
+        shared = np.bincount(np.concatenate(postings), minlength=len(entries))
+        similarity = shared / (len(query_grams) + sizes - shared)
+        candidates = np.flatnonzero(similarity >= FUZZY_MIN_SIMILARITY)
+        # Stable, so equally similar names keep their shortest-first order.
+        candidates = candidates[np.argsort(-similarity[candidates], kind='stable')]
+        return [entries[entry_id] for entry_id in candidates[:limit]]
+
+    def __len__(self):
+        return len(self._index[0])
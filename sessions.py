@@ -0,0 +1,227 @@
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field, fields
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'bot_sessions.sqlite3')
+SESSION_MAX_SIZE = int(os.getenv('SESSION_MAX_SIZE', '200000'))
+SESSION_IDLE_TTL = float(os.getenv('SESSION_IDLE_TTL', str(30 * 24 * 3600)))
+
+
+@dataclass(slots=True)
+class Comparison:
+    device1: str = None
+    device1_id: str = None
+    device2: str = None
+    device2_id: str = None
+    region1: str = None
+    region2: str = None
+    many: list = None
+
+
+@dataclass(slots=True)
+class ChatState:
+    # Comparison fields live in their own object that only exists while a
+    # comparison is in progress, which keeps the common case small.
+    selected_country: str = None
+    selected_device: str = None
+    device_id: str = None
+    comparison: Comparison = None
+    touched_at: float = field(default=0.0, repr=False, compare=False)
+
+    @property
+    def comparing(self):
+        return self.comparison is not None and self.comparison.many is None
+
+    @property
+    def comparing_many(self):
+        return self.comparison.many if self.comparison is not None else None
+
+    def start_comparison(self):
+        self.comparison = Comparison()
+
+    def start_multi_comparison(self):
+        self.comparison = Comparison(many=[])
+
+    def reset_comparison(self):
+        self.comparison = None
+
+    def reset_device(self):
+        self.selected_device = None
+        self.device_id = None
+
+    def as_dict(self):
+        data = {name: getattr(self, name) for name in STATE_FIELDS if getattr(self, name) is not None}
+        if self.comparison is not None:
+            data['comparison'] = {
+                name: getattr(self.comparison, name)
+                for name in COMPARISON_FIELDS
+                if getattr(self.comparison, name) is not None
+            }
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(**{name: data[name] for name in STATE_FIELDS if name in data})
+        comparison = data.get('comparison')
+        if comparison is not None:
+            state.comparison = Comparison(**{name: comparison[name] for name in COMPARISON_FIELDS if name in comparison})
+            if state.comparison.many is not None:
+                state.comparison.many = [tuple(device) for device in state.comparison.many]
+        return state
+
+
+STATE_FIELDS = ('selected_country', 'selected_device', 'device_id')
+COMPARISON_FIELDS = tuple(comparison_field.name for comparison_field in fields(Comparison))
+
+
+class InMemorySessionStore:
+    # A plain dict keeps the per-chat overhead low. Instead of maintaining a
+    # linked LRU order, the oldest chats are evicted in batches when the store
+    # is full and idle chats are swept periodically.
+    def __init__(self, max_size=SESSION_MAX_SIZE, idle_ttl=SESSION_IDLE_TTL, clock=time.monotonic,
+                 evict_fraction=0.05, sweep_interval=600):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.evict_count = max(1, int(max_size * evict_fraction))
+        self.sweep_interval = sweep_interval
+        self.evicted = 0
+        self._states = {}
+        self._next_sweep = clock() + sweep_interval
+        self._lock = threading.Lock()
+
+    def get(self, chat_id):
+        with self._lock:
+            now = self.clock()
+            state = self._live(chat_id, now)
+            if state is None:
+                state = self._states[chat_id] = ChatState()
+            state.touched_at = now
+            self._maintain(now)
+            return state
+
+    def peek(self, chat_id):
+        with self._lock:
+            now = self.clock()
+            state = self._live(chat_id, now)
+            if state is not None:
+                state.touched_at = now
+            return state
+
+    def save(self, chat_id, state):
+        with self._lock:
+            now = self.clock()
+            state.touched_at = now
+            self._states[chat_id] = state
+            self._maintain(now)
+
+    def discard(self, chat_id):
+        with self._lock:
+            self._states.pop(chat_id, None)
+
+    def _live(self, chat_id, now):
+        state = self._states.get(chat_id)
+        if state is not None and now - state.touched_at > self.idle_ttl:
+            del self._states[chat_id]
+            return None
+        return state
+
+    def _maintain(self, now):
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            expired = [chat_id for chat_id, state in self._states.items() if now - state.touched_at > self.idle_ttl]
+            self._remove(expired)
+        if len(self._states) > self.max_size:
+            oldest = heapq.nsmallest(self.evict_count, self._states.items(), key=lambda item: item[1].touched_at)
+            self._remove([chat_id for chat_id, _ in oldest])
+
+    def _remove(self, chat_ids):
+        for chat_id in chat_ids:
+            del self._states[chat_id]
+        self.evicted += len(chat_ids)
+
+    def __len__(self):
+        return len(self._states)
+
+
+class SQLiteSessionStore:
+    # Shared by every worker process on the host; each thread keeps its own
+    # connection. The file is opened on first use, so importing the views
+    # creates nothing.
+    def __init__(self, path=SESSION_DB_PATH, max_size=SESSION_MAX_SIZE, idle_ttl=SESSION_IDLE_TTL,
+                 clock=time.time, prune_every=1000):
+        self.path = path
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.prune_every = prune_every
+        self._writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS chat_sessions ('
+                'chat_id INTEGER PRIMARY KEY, state TEXT NOT NULL, touched_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS chat_sessions_touched ON chat_sessions (touched_at)')
+            self._local.connection = connection
+        return connection
+
+    def get(self, chat_id):
+        state = self.peek(chat_id)
+        return state if state is not None else ChatState()
+
+    def peek(self, chat_id):
+        row = self._connection().execute(
+            'SELECT state, touched_at FROM chat_sessions WHERE chat_id = ?', (chat_id,)
+        ).fetchone()
+        if row is None or self.clock() - row[1] > self.idle_ttl:
+            return None
+        return ChatState.from_dict(json.loads(row[0]))
+
+    def save(self, chat_id, state):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO chat_sessions (chat_id, state, touched_at) VALUES (?, ?, ?)',
+            (chat_id, json.dumps(state.as_dict(), separators=(',', ':')), self.clock()),
+        )
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.prune_every == 0
+        if due:
+            self.prune()
+
+    def discard(self, chat_id):
+        self._connection().execute('DELETE FROM chat_sessions WHERE chat_id = ?', (chat_id,))
+
+    def prune(self):
+        connection = self._connection()
+        connection.execute('DELETE FROM chat_sessions WHERE touched_at < ?', (self.clock() - self.idle_ttl,))
+        connection.execute(
+            'DELETE FROM chat_sessions WHERE chat_id IN ('
+            'SELECT chat_id FROM chat_sessions ORDER BY touched_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_size,),
+        )
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM chat_sessions').fetchone()[0]
+
+
+def create_session_store():
+    if SESSION_BACKEND == 'sqlite':
+        return SQLiteSessionStore()
+    return InMemorySessionStore()
@@ -0,0 +1,17 @@
+import os
+
+
+def run_worker(updates, environ):
+    # The entry point of a shard process. This module imports nothing that
+    # reads the environment, so the shard's settings are in place before the
+    # bot modules load.
+    os.environ.update(environ)
+    import django
+    django.setup()
+    from bot import views
+    views.start_shard_worker()
+    while True:
+        update = updates.get()
+        if update is None:
+            return
+        views.handle_raw_update(update)
@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from bot.shard_worker import run_worker
+
+load_dotenv()
+
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '0')) or os.cpu_count() or 1
+# Set in the worker processes only.
+BOT_WORKER_SHARD = os.getenv('BOT_WORKER_SHARD')
+SNAPSHOT_SHM_NAME = os.getenv('SNAPSHOT_SHM_NAME')
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '256'))
+
+UPDATE_SOURCES = ('message', 'edited_message', 'channel_post', 'edited_channel_post')
+
+
+def shard_of(chat_id, workers=BOT_WORKERS):
+    return int(chat_id) % workers
+
+
+def owns_chat(chat_id):
+    return BOT_WORKER_SHARD is None or shard_of(chat_id) == int(BOT_WORKER_SHARD)
+
+
+def raw_chat_id(update):
+    # update_pool.update_chat_id for the JSON form, which is what the supervisor forwards.
+    for source in UPDATE_SOURCES:
+        if source in update:
+            return update[source]['chat']['id']
+    for source in ('callback_query', 'inline_query'):
+        if source in update:
+            return update[source]['from']['id']
+    return update['update_id']
+
+
+class ShardSupervisor:
+    # Runs one bot process per shard. Updates are routed by chat id, so a
+    # chat always lands on the same worker and its updates stay in order.
+    # The supervisor polls the stations once per cycle and publishes the
+    # readings into shared memory for the workers.
+    def __init__(self, snapshot, poller, get_updates, workers=BOT_WORKERS, environ=None, queue_size=SHARD_QUEUE_SIZE):
+        self.snapshot = snapshot
+        self.poller = poller
+        self.get_updates = get_updates
+        self.workers = workers
+        self.environ = dict(environ or {})
+        self.queue_size = queue_size
+        self.dispatched = [0] * workers
+        self.restarts = [0] * workers
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = []
+        self._processes = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._processes:
+                return False
+            self._queues = [self._context.Queue(self.queue_size) for _ in range(self.workers)]
+            self._processes = [self._spawn(shard) for shard in range(self.workers)]
+        self.poller.start()
+        threading.Thread(target=self._monitor, name='shard-monitor', daemon=True).start()
+        return True
+
+    def _spawn(self, shard):
+        environ = dict(self.environ, BOT_WORKER_SHARD=str(shard), BOT_WORKERS=str(self.workers),
+                       SNAPSHOT_SHM_NAME=self.snapshot.name)
+        process = self._context.Process(target=run_worker, args=(self._queues[shard], environ),
+                                        name=f'bot-shard-{shard}', daemon=True)
+        process.start()
+        return process
+
+    def _monitor(self):
+        while not self._stop.wait(1):
+            for shard, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stop.is_set():
+                    print(f"Bot shard {shard} exited with {process.exitcode}, restarting")
+                    self.restarts[shard] += 1
+                    self._processes[shard] = self._spawn(shard)
+
+    def dispatch(self, update, block=True):
+        shard = shard_of(raw_chat_id(update), self.workers)
+        try:
+            self._queues[shard].put(update, block=block)
+        except queue.Full:
+            return False
+        self.dispatched[shard] += 1
+        return True
+
+    def poll(self):
+        # Long polling for all shards; a full shard queue holds the loop back.
+        # An update is acknowledged (by the next call's offset) only once it
+        # is in its shard's queue. Updates still queued when a process dies
+        # are lost, since Telegram has already been told about them.
+        offset = None
+        while not self._stop.is_set():
+            try:
+                updates = self.get_updates(offset)
+            except Exception as e:
+                print(f"Error polling updates: {e}")
+                time.sleep(1)
+                continue
+            for update in updates:
+                self.dispatch(update)
+                offset = update['update_id'] + 1
+
+    def stop(self):
+        self._stop.set()
+        self.poller.stop()
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+        self.snapshot.close()
+
+    def stats(self):
+        return {
+            str(shard): {
+                'alive': int(process.is_alive()),
+                'queued': self._queues[shard].qsize(),
+                'dispatched': self.dispatched[shard],
+                'restarts': self.restarts[shard],
+            }
+            for shard, process in enumerate(self._processes)
+        }
@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from dotenv import load_dotenv
+
+from bot.classifiers import BATCH_FIELDS
+from bot.snapshot import SnapshotStore, SnapshotEntry, STALE_AFTER
+
+load_dotenv()
+
+SNAPSHOT_CAPACITY = int(os.getenv('SNAPSHOT_CAPACITY', '1024'))
+SNAPSHOT_WATCH_INTERVAL = float(os.getenv('SNAPSHOT_WATCH_INTERVAL', '1.0'))
+
+MEASUREMENT_FIELDS = ('timestamp', 'uv', 'lux', 'temperature', 'pressure', 'humidity', 'pm1', 'pm2_5', 'pm10',
+                      'wind_speed', 'rain', 'wind_direction')
+ID_SIZE = 64
+TEXT_SIZE = 40
+
+# Values keep their Python type, so a shared reading renders exactly like a local one.
+MISSING, INTEGER, REAL, TEXT = 0, 1, 2, 3
+
+META = np.dtype([('cycle', '<i8'), ('published_at', '<f8'), ('count', '<i8')])
+RECORD = np.dtype([
+    ('device_id', f'S{ID_SIZE}'),
+    ('bucket', '<i8'),
+    ('fetched_at', '<f8'),
+    ('updated_at', '<f8'),
+    ('kinds', 'i1', (len(MEASUREMENT_FIELDS),)),
+    ('numbers', '<f8', (len(MEASUREMENT_FIELDS),)),
+    ('texts', f'S{TEXT_SIZE}', (len(MEASUREMENT_FIELDS),)),
+])
+CONTROL_SIZE = 8
+
+
+def layout_size(capacity):
+    return CONTROL_SIZE + 2 * META.itemsize + 2 * capacity * RECORD.itemsize
+
+
+def _arrays(buffer, capacity):
+    # One generation counter, then two buffers of (meta, records). The
+    # writer fills the buffer readers are not using and flips the counter.
+    control = np.ndarray((1,), '<i8', buffer, 0)
+    meta = np.ndarray((2,), META, buffer, CONTROL_SIZE)
+    records = np.ndarray((2, capacity), RECORD, buffer, CONTROL_SIZE + 2 * META.itemsize)
+    return control, meta, records
+
+
+def encode_value(value):
+    if value is None:
+        return MISSING, np.nan, b''
+    if isinstance(value, int) and not isinstance(value, bool):
+        return INTEGER, value, b''
+    if isinstance(value, float):
+        return REAL, value, b''
+    return TEXT, np.nan, str(value).encode('utf-8')[:TEXT_SIZE]
+
+
+def decode_value(kind, number, text):
+    if kind == INTEGER:
+        return int(number)
+    if kind == REAL:
+        return number
+    if kind == TEXT:
+        return text.decode('utf-8', 'ignore')
+    return None
+
+
+def encode(device_id, entry):
+    measurement = entry.measurement
+    kinds, numbers, texts = zip(*(encode_value(measurement.get(field)) for field in MEASUREMENT_FIELDS))
+    return (str(device_id).encode('utf-8')[:ID_SIZE], entry.bucket, entry.fetched_at, entry.updated_at,
+            kinds, numbers, texts)
+
+
+def decode(record):
+    _, bucket, fetched_at, updated_at, kinds, numbers, texts = record.item()
+    measurement = {
+        field: decode_value(kind, number, text)
+        for field, kind, number, text in zip(MEASUREMENT_FIELDS, kinds.tolist(), numbers.tolist(), texts.tolist())
+    }
+    return SnapshotEntry(measurement, bucket, fetched_at, updated_at)
+
+
+class SharedSnapshotWriter(SnapshotStore):
+    # The supervisor's store. Each publish also writes every entry into a
+    # shared memory block that the worker processes read.
+    def __init__(self, capacity=SNAPSHOT_CAPACITY, **kwargs):
+        super().__init__(**kwargs)
+        self.capacity = capacity
+        self.dropped = 0
+        self.memory = shared_memory.SharedMemory(create=True, size=layout_size(capacity))
+        self._control, self._meta, self._records = _arrays(self.memory.buf, capacity)
+        self._export_lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def publish(self, results):
+        super().publish(results)
+        self.export()
+
+    def export(self):
+        with self._export_lock:
+            entries = list(self.entries().items())
+            if len(entries) > self.capacity:
+                self.dropped = len(entries) - self.capacity
+                print(f"Shared snapshot holds {self.capacity} devices, dropping {self.dropped}")
+                entries = entries[:self.capacity]
+            generation = int(self._control[0]) + 1
+            buffer = generation % 2
+            for row, (device_id, entry) in enumerate(entries):
+                self._records[buffer, row] = encode(device_id, entry)
+            self._meta[buffer] = (self.cycle, self.published_at or 0.0, len(entries))
+            self._control[0] = generation
+
+    def close(self):
+        # Called by the supervisor's stop and again at exit.
+        if self._control is None:
+            return
+        self._control = self._meta = self._records = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+class SharedSnapshotReader(SnapshotStore):
+    # A worker's view of the supervisor's snapshot. An entry is decoded the
+    # first time it is read in each generation; nothing else is copied out.
+    # A read that overlaps a flip is retried, like a seqlock.
+    def __init__(self, name, stale_after=STALE_AFTER, clock=time.time, watch_interval=SNAPSHOT_WATCH_INTERVAL):
+        self.stale_after = stale_after
+        self.clock = clock
+        self.watch_interval = watch_interval
+        # Workers are spawned by the supervisor and share its resource tracker,
+        # so attaching here does not make the block outlive or predecease it.
+        self.memory = shared_memory.SharedMemory(name=name)
+        capacity = (self.memory.size - CONTROL_SIZE - 2 * META.itemsize) // (2 * RECORD.itemsize)
+        self._control, self._meta, self._records = _arrays(self.memory.buf, capacity)
+        self._state = (-1, {}, {})
+        self._listeners = []
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        while True:
+            generation = int(self._control[0])
+            state = self._state
+            if state[0] == generation:
+                return state
+            buffer = generation % 2
+            count = int(self._meta[buffer]['count'])
+            ids = self._records[buffer, :count]['device_id'].tolist()
+            index = {device_id.decode('utf-8', 'ignore'): row for row, device_id in enumerate(ids)}
+            if int(self._control[0]) == generation:
+                state = self._state = (generation, index, {})
+                return state
+
+    def get(self, device_id):
+        while True:
+            generation, index, decoded = self._current()
+            entry = decoded.get(device_id)
+            if entry is not None:
+                return entry
+            row = index.get(device_id)
+            if row is None:
+                return None
+            record = self._records[generation % 2, row].copy()
+            if int(self._control[0]) == generation:
+                entry = decoded[device_id] = decode(record)
+                return entry
+
+    def entries(self):
+        entries = {}
+        for device_id in self._current()[1]:
+            entry = self.get(device_id)
+            if entry is not None:
+                entries[device_id] = entry
+        return entries
+
+    def columns(self, fields=BATCH_FIELDS):
+        # Sliced straight out of the shared numbers, which already hold NaN
+        # for missing values, without decoding any entry.
+        positions = [MEASUREMENT_FIELDS.index(field) for field in fields]
+        while True:
+            generation, index, _ = self._current()
+            numbers = self._records[generation % 2, :len(index)]['numbers'][:, positions]
+            if int(self._control[0]) == generation:
+                return list(index), dict(zip(fields, numbers.T))
+
+    def _meta_value(self, field):
+        generation = int(self._control[0])
+        return self._meta[generation % 2][field].item() if generation else None
+
+    @property
+    def cycle(self):
+        return self._meta_value('cycle') or 0
+
+    @property
+    def published_at(self):
+        return self._meta_value('published_at')
+
+    def publish(self, results):
+        raise TypeError("The shared snapshot is published by the supervisor")
+
+    def subscribe(self, listener):
+        # Listeners are called from a watcher thread when the supervisor publishes a new cycle.
+        self._listeners.append(listener)
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='snapshot-watcher', daemon=True)
+                self._watcher.start()
+
+    def _watch(self):
+        seen_cycle, seen_at = 0, 0.0
+        while True:
+            time.sleep(self.watch_interval)
+            cycle, published_at = self.cycle, self.published_at
+            if not cycle or cycle == seen_cycle:
+                continue
+            changed = {
+                device_id: entry.measurement
+                for device_id, entry in self.entries().items()
+                if entry.updated_at > seen_at
+            }
+            seen_cycle, seen_at = cycle, published_at
+            if not changed:
+                continue
+            for listener in self._listeners:
+                try:
+                    listener(changed)
+                except Exception as e:
+                    print(f"Error in snapshot listener: {e}")
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import namedtuple
+
+from bot.classifiers import BATCH_FIELDS, measurement_columns
+from bot.measurement_cache import REPORT_INTERVAL, REPORT_DELAY, report_bucket
+
+# A station is flagged once its reading has not changed for three cycles.
+STALE_AFTER = 3 * REPORT_INTERVAL
+POLL_OFFSET = REPORT_DELAY + 5
+# A cold start fetches the catalog in the background; until it has devices
+# the poller checks again this often instead of waiting for the next cycle.
+POLL_RETRY = 2
+
+SnapshotEntry = namedtuple('SnapshotEntry', ['measurement', 'bucket', 'fetched_at', 'updated_at'])
+
+
+class SnapshotStore:
+    def __init__(self, stale_after=STALE_AFTER, clock=time.time):
+        self.stale_after = stale_after
+        self.clock = clock
+        self.cycle = 0
+        self.published_at = None
+        self._entries = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        # listener(measurements) receives {device_id: measurement} for the
+        # devices whose timestamp changed in a published cycle.
+        self._listeners.append(listener)
+
+    def publish(self, results):
+        now = self.clock()
+        bucket = report_bucket(now)
+        changed = {}
+        with self._lock:
+            # Copy on write: readers keep using the previous dict until the swap.
+            entries = dict(self._entries)
+            for device_id, measurement in results.items():
+                if not measurement:
+                    continue
+                previous = entries.get(device_id)
+                if previous is not None and previous.measurement.get('timestamp') == measurement.get('timestamp'):
+                    updated_at = previous.updated_at
+                else:
+                    updated_at = now
+                    changed[device_id] = measurement
+                entries[device_id] = SnapshotEntry(measurement, bucket, now, updated_at)
+            self._entries = entries
+            self.cycle += 1
+            self.published_at = now
+        if changed:
+            for listener in self._listeners:
+                try:
+                    listener(changed)
+                except Exception as e:
+                    print(f"Error in snapshot listener: {e}")
+
+    def get(self, device_id):
+        return self._entries.get(device_id)
+
+    def entries(self):
+        return self._entries
+
+    def columns(self, fields=BATCH_FIELDS):
+        # Every reading as (device ids, {field: float column}) for the batch classifiers.
+        entries = self.entries()
+        return list(entries), measurement_columns([entry.measurement for entry in entries.values()], fields)
+
+    def current(self, device_id):
+        entry = self.get(device_id)
+        if entry is not None and entry.bucket == report_bucket(self.clock()):
+            return entry.measurement
+        return None
+
+    def stale_minutes(self, device_id):
+        entry = self.get(device_id)
+        if entry is None:
+            return None
+        age = self.clock() - entry.updated_at
+        if age <= self.stale_after:
+            return None
+        return int(age // 60)
+
+    def freshness(self):
+        now = self.clock()
+        return {
+            device_id: {
+                'fetched_seconds_ago': round(now - entry.fetched_at),
+                'unchanged_seconds': round(now - entry.updated_at),
+                'stale': now - entry.updated_at > self.stale_after,
+            }
+            for device_id, entry in self.entries().items()
+        }
+
+    def __len__(self):
+        return len(self.entries())
+
+
+class SnapshotPoller:
+    def __init__(self, store, list_device_ids, fetch_many, interval=REPORT_INTERVAL, offset=POLL_OFFSET,
+                 retry=POLL_RETRY):
+        self.store = store
+        self.list_device_ids = list_device_ids
+        self.fetch_many = fetch_many
+        self.interval = interval
+        self.offset = offset
+        self.retry = retry
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='snapshot-poller', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.poll_once():
+                self._stop.wait(self.seconds_until_next())
+            else:
+                self._stop.wait(self.retry)
+
+    def poll_once(self):
+        # False while there is no device to poll; an empty cycle is not published.
+        device_id_list = list(self.list_device_ids())
+        if not device_id_list:
+            return False
+        try:
+            results = self.fetch_many(device_id_list)
+        except Exception as e:
+            print(f"Error refreshing measurement snapshot: {e}")
+            return True
+        self.store.publish(dict(zip(device_id_list, results)))
+        return True
+
+    def seconds_until_next(self, now=None):
+        if now is None:
+            now = time.time()
+        next_run = ((now - self.offset) // self.interval + 1) * self.interval + self.offset
+        return next_run - now
@@ -0,0 +1,60 @@
+import queue
+import threading
+
+
+def update_chat_id(update):
+    for source in (update.message, update.edited_message, update.channel_post):
+        if source is not None:
+            return source.chat.id
+    if update.callback_query is not None:
+        return update.callback_query.from_user.id
+    if update.inline_query is not None:
+        return update.inline_query.from_user.id
+    return update.update_id
+
+
+class UpdateWorkerPool:
+    # Each worker owns one bounded queue and updates are sharded by chat, so
+    # a chat's updates are handled in order while different chats run in parallel.
+    def __init__(self, process_updates, workers=8, queue_size=64):
+        self.process_updates = process_updates
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rejected = 0
+        self._queues = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._queues:
+                return False
+            self._queues = [queue.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+            for i, updates in enumerate(self._queues):
+                threading.Thread(target=self._run, args=(updates,), name=f'update-worker-{i}', daemon=True).start()
+            return True
+
+    def submit(self, update, block=False):
+        queues = self._queues
+        if not queues:
+            # Not started: this process does not take updates through the pool.
+            return False
+        updates = queues[hash(update_chat_id(update)) % len(queues)]
+        try:
+            updates.put(update, block=block)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        return True
+
+    def depth(self):
+        return sum(updates.qsize() for updates in self._queues)
+
+    def _run(self, updates):
+        while True:
+            update = updates.get()
+            try:
+                self.process_updates([update])
+            except Exception as e:
+                print(f"Error processing update {update.update_id}: {e}")
+            finally:
+                updates.task_done()
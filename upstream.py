@@ -0,0 +1,223 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+load_dotenv()
+
+CLIMATENET_BASE_URL = os.getenv('CLIMATENET_BASE_URL', 'https://climatenet.am')
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '20'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '3.05'))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '10'))
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '2'))
+UPSTREAM_BACKOFF = float(os.getenv('UPSTREAM_BACKOFF', '0.25'))
+UPSTREAM_BREAKER_FAILURES = int(os.getenv('UPSTREAM_BREAKER_FAILURES', '5'))
+UPSTREAM_BREAKER_RESET = float(os.getenv('UPSTREAM_BREAKER_RESET', '30'))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+class RetryBudget:
+    # Every request earns a fraction of a retry, so retries stay a bounded
+    # share of traffic and cannot snowball while the upstream is struggling.
+    def __init__(self, ratio=0.2, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    # Opens after `failures` failed calls in a row and rejects calls for
+    # `reset_after` seconds. Then a single probe goes through: success closes
+    # the circuit, failure opens it for another period.
+    def __init__(self, failures=UPSTREAM_BREAKER_FAILURES, reset_after=UPSTREAM_BREAKER_RESET, clock=time.monotonic):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.clock = clock
+        self.state = CLOSED
+        self.opens = 0
+        self.rejected = 0
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() - self._opened_at >= self.reset_after:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self._consecutive = 0
+                self.state = CLOSED
+            else:
+                self._consecutive += 1
+                if self.state == HALF_OPEN or self._consecutive >= self.failures:
+                    if self.state != OPEN:
+                        self.opens += 1
+                    self.state = OPEN
+                    self._opened_at = self.clock()
+            self._probing = False
+
+    @property
+    def closed(self):
+        return self.state == CLOSED
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'opens': self.opens,
+                'rejected': self.rejected,
+                'consecutive_failures': self._consecutive,
+            }
+
+
+class CircuitBreakers:
+    # One breaker per endpoint. The sync and async clients for a host share
+    # one set, so both see the same view of the upstream.
+    def __init__(self, **settings):
+        self.settings = settings
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(endpoint, CircuitBreaker(**self.settings))
+        return breaker
+
+    def stats(self):
+        return {endpoint: breaker.stats() for endpoint, breaker in list(self._breakers.items())}
+
+
+class LatencyRecorder:
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+            if error:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            snapshot = {endpoint: sorted(samples) for endpoint, samples in self._samples.items()}
+            counts = dict(self._counts)
+            errors = dict(self._errors)
+        result = {}
+        for endpoint, samples in snapshot.items():
+            result[endpoint] = {
+                'requests': counts.get(endpoint, 0),
+                'errors': errors.get(endpoint, 0),
+                'mean_ms': 1000 * sum(samples) / len(samples),
+                'p50_ms': 1000 * samples[len(samples) // 2],
+                'p99_ms': 1000 * samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            }
+        return result
+
+
+class UpstreamClient:
+    def __init__(self, base_url, pool_size=UPSTREAM_POOL_SIZE,
+                 connect_timeout=UPSTREAM_CONNECT_TIMEOUT, read_timeout=UPSTREAM_READ_TIMEOUT,
+                 retries=UPSTREAM_RETRIES, backoff=UPSTREAM_BACKOFF, breakers=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.breakers = breakers or CircuitBreakers()
+        self.retries = retries
+        self.backoff = backoff
+        self.budget = RetryBudget()
+        self.latency = LatencyRecorder()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, path, endpoint=None):
+        url = self.base_url + path
+        endpoint = endpoint or path
+        breaker = self.breakers.get(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {endpoint}")
+        try:
+            response = self._get(url, endpoint)
+        except BaseException:
+            breaker.record(False)
+            raise
+        breaker.record(response.status_code not in RETRY_STATUSES)
+        return response
+
+    def _get(self, url, endpoint):
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                self.latency.record(endpoint, time.perf_counter() - start, error=True)
+                if not self._should_retry(attempt):
+                    raise
+            else:
+                failed = response.status_code in RETRY_STATUSES
+                self.latency.record(endpoint, time.perf_counter() - start, error=failed)
+                if not failed or not self._should_retry(attempt):
+                    return response
+                response.close()
+            time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+            attempt += 1
+
+    def _should_retry(self, attempt):
+        return attempt < self.retries and self.budget.withdraw()
+
+    def available(self, endpoint):
+        return self.breakers.get(endpoint).closed
+
+    def latency_stats(self):
+        return self.latency.stats()
+
+
+climatenet_client = UpstreamClient(CLIMATENET_BASE_URL)
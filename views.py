@@ -1,10 +1,17 @@
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 import requests
 import telebot
-from telebot import types
+from telebot import types, util
 import threading
 import time
+import atexit
+import functools
+import hmac
+import inspect
+from html import escape
+from concurrent.futures import ThreadPoolExecutor
 import os
 from dotenv import load_dotenv
 from bot.models import Device
@@ -13,345 +20,557 @@ import django
 from django.conf import settings
 from users.utils import save_telegram_user, save_users_locations
 from BotAnalytics.views import log_command_decorator, save_selected_device_to_db
+from bot.measurement_cache import MeasurementCache
+from bot.upstream import climatenet_client, UPSTREAM_POOL_SIZE
+from bot.health import DeviceHealth
+from bot.snapshot import SnapshotStore, SnapshotPoller
+from bot.routing import RoutingIndex, COUNTRY, DEVICE
+from bot.update_pool import UpdateWorkerPool
+from bot.sessions import create_session_store
+from bot.keyboards import KeyboardCache
+from bot.classifiers import uv_index, pm_level, detect_weather_condition
+from bot.rendering import Renderer
+from bot.history import HistoryStore, from_epoch
+from bot.outbox import Outbox, OUTBOX_GLOBAL_RATE
+from bot.alerts import ALERT_RULES, ALERT_COMMANDS, ALERTS_DB_PATH, AlertSubscriptions, AlertEngine, ProcessLease
+from bot.write_behind import WriteBehindBuffer, KnownUsers
+from bot.geo import StationIndex
+from bot.search import SearchIndex
+from bot.leaderboard import Leaderboard, RANKING_COMMANDS
+from bot.metrics import MetricsRegistry, SlowUpdateProfiler, PROFILE_SLOW_MS
+from bot.catalog import CatalogLoader
+from bot.lazy_bot import LazyBot
+from bot.shards import ShardSupervisor, BOT_WORKERS, BOT_WORKER_SHARD, SNAPSHOT_SHM_NAME, owns_chat
+from bot.shared_snapshot import SharedSnapshotReader, SharedSnapshotWriter
 
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+BOT_ENGINE = os.getenv('BOT_ENGINE', 'sync')
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '64'))
+# /metrics answers 403 until a token is set.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Points the bot at another Bot API server, such as a local one or the load-test fake.
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+def create_bot():
+    if TELEGRAM_API_URL:
+        telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+    # Webhook and shard updates run on the update pool and the async engine
+    # only sends through the outbox, so only sync polling needs telebot's own threads.
+    return telebot.TeleBot(TELEGRAM_BOT_TOKEN, threaded=BOT_MODE == 'polling' and BOT_ENGINE == 'sync')
+
+# The client is built on first use; the async engine only sends with it.
+bot = LazyBot(create_bot)
+metrics = MetricsRegistry(profiler=SlowUpdateProfiler(PROFILE_SLOW_MS / 1000) if PROFILE_SLOW_MS else None)
+outbox = Outbox(bot)
+update_pool = UpdateWorkerPool(lambda updates: bot.process_new_updates(updates), workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+write_buffer = WriteBehindBuffer()
+known_users = KnownUsers()
+atexit.register(write_buffer.close)
+bot_start_lock = threading.Lock()
+bot_started = False
+shard_supervisor = None
+
+def command_logger(name):
+    # log_command_decorator around a no-op, so the entry can be written behind the reply.
+    def record(message):
+        return None
+    record.__name__ = name
+    return log_command_decorator(record)
+
+def logged(body):
+    log_command = command_logger(body.__name__)
+
+    @functools.wraps(body)
+    def wrapper(message):
+        write_buffer.submit(log_command, message)
+        with metrics.track(body.__name__):
+            run_handler(body, message)
+    return wrapper
+
+# Handler bodies are shared by both engines. A body that needs measurements
+# is a generator: it yields the device ids and is sent their measurements,
+# which the sync engine fetches here and the async engine on its event loop.
+HANDLERS = []
+
+def handler(**filters):
+    def decorator(body):
+        HANDLERS.append((filters, body))
+        bot.message_handler(**filters)(logged(body))
+        return body
+    return decorator
+
+def advance(steps, measurements=None):
+    # The device ids the body asks for next, or None once it has finished.
+    try:
+        return steps.send(measurements)
+    except StopIteration:
+        return None
+
+def run_handler(body, message):
+    steps = body(message)
+    if inspect.isgenerator(steps):
+        device_id_list = advance(steps)
+        while device_id_list is not None:
+            device_id_list = advance(steps, get_measurements(device_id_list))
+
+def remember_user(user):
+    # A profile that was not saved is forgotten, so the user's next update writes it again.
+    forget = functools.partial(known_users.forget, user.id)
+    if known_users.changed(user) and not write_buffer.submit(save_telegram_user, user, key=user.id, on_error=forget):
+        forget()
 
 def get_device_data():
-    url = "https://climatenet.am/device_inner/list/"
     try:
-        response = requests.get(url)
+        response = climatenet_client.get("/device_inner/list/", endpoint="device_list")
         response.raise_for_status()  
         devices = response.json()
         locations = defaultdict(list)
         device_ids = {}
+        coordinates = {}
         for device in devices:
             device_ids[device["name"]] = device["generated_id"]
             locations[device.get("parent_name", "Unknown")].append(device["name"])
-        return locations, device_ids
-    except requests.RequestException as e:
+            coordinates[device["name"]] = (device.get("latitude"), device.get("longitude"))
+        return dict(locations), device_ids, coordinates
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
         print(f"Error fetching device data: {e}")
-        return {}, {}
-
-locations, device_ids = get_device_data()
-user_context = {}
+        return None
 
-devices_with_issues = ["Berd", "Ashotsk", "Gavar", "Artsvaberd", 
-                       "Chambarak", "Areni", "Amasia"]
+locations, device_ids, device_names = {}, {}, {}
+device_router = RoutingIndex()
+station_index = StationIndex()
+search_index = SearchIndex()
+keyboard_cache = KeyboardCache()
+renderer = Renderer()
+history_store = HistoryStore()
+
+catalog_lock = threading.Lock()
+
+def set_device_catalog(new_locations, new_device_ids, new_coordinates=None):
+    global locations, device_ids, device_names
+    new_device_names = {device_id: name for name, device_id in new_device_ids.items()}
+    with catalog_lock:
+        device_router.rebuild(new_locations, new_device_ids)
+        station_index.rebuild(new_coordinates or {})
+        search_index.rebuild(new_locations, new_device_ids)
+        locations, device_ids, device_names = new_locations, new_device_ids, new_device_names
+        keyboard_cache.invalidate()
+
+# Start from the last saved catalog; the fetch runs in the background once the bot starts.
+catalog_loader = CatalogLoader(get_device_data, set_device_catalog)
+catalog_loader.load()
+sessions = create_session_store()
+measurement_cache = MeasurementCache()
+fetch_executor = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix='climatenet')
+
+# Shard workers read the snapshot their supervisor publishes. The supervisor
+# only polls and publishes; alerts and rankings run in the workers.
+SHARD_SUPERVISOR = BOT_MODE == 'sharded' and BOT_WORKER_SHARD is None
+if SNAPSHOT_SHM_NAME:
+    measurement_snapshot = SharedSnapshotReader(SNAPSHOT_SHM_NAME)
+elif SHARD_SUPERVISOR:
+    measurement_snapshot = SharedSnapshotWriter()
+    atexit.register(measurement_snapshot.close)
+else:
+    measurement_snapshot = SnapshotStore()
+alert_subscriptions = AlertSubscriptions()
+alert_engine = AlertEngine(
+    alert_subscriptions,
+    # Every shard evaluates the rules and notifies the chats routed to it.
+    lambda chat_ids, text: outbox.send_many(
+        [chat_id for chat_id in chat_ids if owns_chat(chat_id)], text, parse_mode='HTML'),
+    lambda device_id: device_names.get(device_id, device_id),
+    # Web processes share one subscription file; one of them notifies.
+    lease=None if BOT_WORKER_SHARD is not None or ALERTS_DB_PATH == ':memory:' else ProcessLease(),
+)
+if not SHARD_SUPERVISOR:
+    measurement_snapshot.subscribe(alert_engine.on_measurements)
+
+metrics.register('upstream', climatenet_client.latency_stats, label='endpoint')
+metrics.register('upstream_circuit', climatenet_client.breakers.stats, label='endpoint')
+metrics.register('catalog', catalog_loader.stats)
+metrics.register('measurement_cache', measurement_cache.stats)
+metrics.register('keyboard_cache', keyboard_cache.stats)
+metrics.register('render_cache', renderer.stats, label='cache')
+metrics.register('outbox', outbox.stats)
+metrics.register('update_pool', lambda: {'depth': update_pool.depth(), 'rejected': update_pool.rejected})
+metrics.register('write_buffer', write_buffer.stats)
+metrics.register('sessions', lambda: {'size': len(sessions), 'evicted': getattr(sessions, 'evicted', 0)})
+metrics.register('snapshot', lambda: {'devices': len(measurement_snapshot), 'cycle': measurement_snapshot.cycle})
+metrics.register('alerts', lambda: {
+    'subscriptions': len(alert_subscriptions),
+    'evaluations': alert_engine.evaluations,
+    'notifications': alert_engine.notifications,
+})
+
+MULTI_COMPARE_MIN = 3
+MULTI_COMPARE_MAX = 10
+INLINE_RESULTS = 10
+INLINE_CACHE_SECONDS = 60
+NEARBY_STATIONS = 3
+HISTORY_PERIODS = {
+    'History': ('the last 24 hours', 24 * 3600, 24),
+    'History_7d': ('the last 7 days', 7 * 24 * 3600, 28),
+}
+
+NEXT_MEASUREMENT_TEXT = '''For the next measurement, select\t
+/Current 📍 every quarter of the hour. 🕒'''
+INVALID_COMMAND_TEXT = '''❗ Please use a valid command.
+You can see all available commands by typing /Help❓
+'''
+HELP_TEXT = '''
+<b>/Current 📍:</b> Get the latest climate data in selected location.\n
+<b>/Compare 🔍:</b> Compare weather data between two devices.\n
+<b>/Compare_many 📊:</b> Rank 3 to 10 devices side by side.\n
+<b>/Alerts 🔔:</b> Get notified when air quality, UV or snow conditions change.\n
+<b>/History 📈:</b> Show the last 24 hours of the selected device, /History_7d for the last week.\n
+<b>/Ranking 🏆:</b> See the hottest, coldest, cleanest-air and windiest stations right now.\n
+<b>/Overview 📋:</b> See conditions in every region at a glance.\n
+<b>/Change_device 🔄:</b> Change to another climate monitoring device.\n
+<b>/Help ❓:</b> Show available commands.\n
+<b>/Website 🌐:</b> Visit our website for more information.\n
+<b>/Map 🗺️:</b> View the locations of all devices on a map.\n
+<b>/Share_location 🌍:</b> Share your location.\n
+<b>Inline search 🔎:</b> Type the bot's @username and a station name in any chat.\n
+'''
+MAP_IMAGE_URL = 'https://images-in-website.s3.us-east-1.amazonaws.com/Bot/map.png'
+
+device_health = DeviceHealth(measurement_snapshot)
+metrics.register('device_health', lambda: device_health.stats(list(device_ids.values())))
+# Rebuilt from the snapshot once per cycle; stations with issues are not ranked.
+leaderboard = Leaderboard(measurement_snapshot, lambda: (locations, device_ids), renderer, device_health.has_issues)
+if not SHARD_SUPERVISOR:
+    measurement_snapshot.subscribe(lambda changed: leaderboard.rebuild())
+metrics.register('leaderboard', leaderboard.stats)
+revalidating = set()
+revalidating_lock = threading.Lock()
 
 def fetch_latest_measurement(device_id):
-    url = f"https://climatenet.am/device_inner/{device_id}/latest/"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        if data:
-            latest_measurement = data[0]  
-            timestamp = latest_measurement["time"].replace("T", " ")
-            return {
-                "timestamp": timestamp,
-                "uv": latest_measurement.get("uv"),
-                "lux": latest_measurement.get("lux"),
-                "temperature": latest_measurement.get("temperature"),
-                "pressure": latest_measurement.get("pressure"),
-                "humidity": latest_measurement.get("humidity"),
-                "pm1": latest_measurement.get("pm1"),
-                "pm2_5": latest_measurement.get("pm2_5"),
-                "pm10": latest_measurement.get("pm10"),
-                "wind_speed": latest_measurement.get("speed"),
-                "rain": latest_measurement.get("rain"),
-                "wind_direction": latest_measurement.get("wind_direction")
-            }
+    return measurement_cache.get(device_id, request_latest_measurement)
+
+def fetch_latest_measurements(device_id_list):
+    return list(fetch_executor.map(fetch_latest_measurement, device_id_list))
+
+snapshot_poller = SnapshotPoller(measurement_snapshot, lambda: list(device_ids.values()), fetch_latest_measurements)
+
+def get_measurements(device_id_list):
+    # While the upstream circuit is not closed, answer from the last known
+    # readings at once and refresh them in the background.
+    measurements = [measurement_snapshot.current(device_id) for device_id in device_id_list]
+    missing = [device_id for device_id, measurement in zip(device_id_list, measurements) if measurement is None]
+    if missing:
+        if climatenet_client.available('latest'):
+            fetched = dict(zip(missing, fetch_latest_measurements(missing)))
         else:
-            return None
-    else:
+            fetched = {}
+            for device_id in missing:
+                revalidate(device_id)
+        measurements = [measurement or fetched.get(device_id) or get_last_known(device_id)[0]
+                        for device_id, measurement in zip(device_id_list, measurements)]
+    return measurements
+
+def get_last_known(device_id):
+    entry = measurement_snapshot.get(device_id)
+    if entry is not None:
+        return entry.measurement, entry.fetched_at
+    return measurement_cache.last(device_id)
+
+def revalidate(device_id):
+    with revalidating_lock:
+        if device_id in revalidating:
+            return
+        revalidating.add(device_id)
+
+    def refresh():
+        try:
+            fetch_latest_measurement(device_id)
+        finally:
+            with revalidating_lock:
+                revalidating.discard(device_id)
+    fetch_executor.submit(refresh)
+
+def get_staleness_note(device_id, device_name=None):
+    subject = escape(device_name) if device_name else "This device"
+    if measurement_snapshot.current(device_id) is None and not measurement_cache.fresh(device_id):
+        fetched_at = get_last_known(device_id)[1]
+        if fetched_at is not None:
+            minutes = int((time.time() - fetched_at) // 60)
+            return f"\n⏳ Note: climatenet.am is not responding. {subject}'s last known reading is {minutes} minutes old and will update automatically."
+    minutes = measurement_snapshot.stale_minutes(device_id)
+    if minutes is None:
+        return ""
+    return f"\n⏳ Note: {subject} has not reported new data for {minutes} minutes."
+
+def request_latest_measurement(device_id):
+    try:
+        response = climatenet_client.get(f"/device_inner/{device_id}/latest/", endpoint="latest")
+    except requests.RequestException as e:
+        print(f"Error fetching measurement for {device_id}: {e}")
+        return None
+    if response.status_code != 200:
+        device_health.record(device_id, response.status_code, None)
         print(f"Failed to fetch data: {response.status_code}")
         return None
+    # A bad body from one station must not fail the batch it was polled in.
+    try:
+        data = response.json()
+        measurement = parse_latest_measurement(data)
+    except MALFORMED_ERRORS as e:
+        device_health.record(device_id, response.status_code, None)
+        print(f"Malformed measurement for {device_id}: {e!r}")
+        return None
+    device_health.record(device_id, response.status_code, data)
+    record_history(device_id, data)
+    return measurement
+
+MALFORMED_ERRORS = (ValueError, KeyError, IndexError, TypeError, AttributeError)
+
+def parse_latest_measurement(data):
+    if not data:
+        return None
+    return parse_measurement(data[0])
+
+def parse_measurement(latest_measurement):
+    timestamp = latest_measurement["time"].replace("T", " ")
+    return {
+        "timestamp": timestamp,
+        "uv": latest_measurement.get("uv"),
+        "lux": latest_measurement.get("lux"),
+        "temperature": latest_measurement.get("temperature"),
+        "pressure": latest_measurement.get("pressure"),
+        "humidity": latest_measurement.get("humidity"),
+        "pm1": latest_measurement.get("pm1"),
+        "pm2_5": latest_measurement.get("pm2_5"),
+        "pm10": latest_measurement.get("pm10"),
+        "wind_speed": latest_measurement.get("speed"),
+        "rain": latest_measurement.get("rain"),
+        "wind_direction": latest_measurement.get("wind_direction")
+    }
+
+def record_history(device_id, data):
+    # History files have a single writer; with shards that is the supervisor's poller.
+    if BOT_WORKER_SHARD is not None:
+        return
+    try:
+        history_store.extend(device_id, [parse_measurement(item) for item in data or ()])
+    except (OSError, *MALFORMED_ERRORS) as e:
+        print(f"Error recording history for {device_id}: {e}")
 
 def start_bot():
+    bot.remove_webhook()
     bot.polling(none_stop=True)
 
 def run_bot():
+    # Flood errors are handled by the outbox, so anything that gets here is a
+    # polling failure; retry quickly and back off only if it keeps failing.
+    delay = 1
     while True:
+        started = time.monotonic()
         try:
             start_bot()
         except Exception as e:
             print(f"Error occurred: {e}")
-            time.sleep(15)
+            delay = 1 if time.monotonic() - started > 60 else min(delay * 2, 15)
+            time.sleep(delay)
 
-def start_bot_thread():
-    bot_thread = threading.Thread(target=run_bot)
-    bot_thread.start()
+def start_webhook():
+    update_pool.start()
+    bot.set_webhook(url=TELEGRAM_WEBHOOK_URL, secret_token=TELEGRAM_WEBHOOK_SECRET)
 
-def send_location_selection(chat_id, message_text='Please choose a location: 📍'):
+def start_bot_thread():
+    global bot_started
+    with bot_start_lock:
+        if bot_started:
+            return False
+        catalog_loader.start()
+        if BOT_MODE == 'sharded':
+            start_shards()
+            bot_started = True
+            return True
+        snapshot_poller.start()
+        if BOT_ENGINE == 'async':
+            from bot.async_bot import run_async_bot
+            bot_thread = threading.Thread(target=run_async_bot)
+            bot_thread.start()
+        elif BOT_MODE == 'webhook':
+            start_webhook()
+        else:
+            bot_thread = threading.Thread(target=run_bot)
+            bot_thread.start()
+        bot_started = True
+        return True
+
+def get_raw_updates(offset):
+    return telebot.apihelper.get_updates(TELEGRAM_BOT_TOKEN, offset=offset, timeout=20, long_polling_timeout=20)
+
+def start_shards():
+    global shard_supervisor
+    # Telegram's global send limit is shared between the workers.
+    environ = {'OUTBOX_GLOBAL_RATE': str(OUTBOX_GLOBAL_RATE / BOT_WORKERS)}
+    shard_supervisor = ShardSupervisor(measurement_snapshot, snapshot_poller, get_raw_updates, environ=environ)
+    shard_supervisor.start()
+    atexit.register(shard_supervisor.stop)
+    metrics.register('shards', shard_supervisor.stats, label='shard')
+    bot.remove_webhook()
+    threading.Thread(target=shard_supervisor.poll, name='shard-poller').start()
+
+def start_shard_worker():
+    # The supervisor fetches the catalog and rewrites the snapshot file.
+    catalog_loader.follow()
+    update_pool.start()
+
+def handle_raw_update(update):
+    # Blocks while this chat's worker thread is behind, which backs up the shard's queue.
+    update_pool.submit(types.Update.de_json(update), block=True)
+
+def get_location_markup(extra_buttons=()):
+    extra_buttons = tuple(extra_buttons)
+    return keyboard_cache.get(('locations', extra_buttons), lambda: build_location_markup(extra_buttons))
+
+def build_location_markup(extra_buttons):
     location_markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
     for country in locations.keys():
         location_markup.add(types.KeyboardButton(country))
-    bot.send_message(chat_id, message_text, reply_markup=location_markup)
+    for button in extra_buttons:
+        location_markup.add(types.KeyboardButton(button))
+    return location_markup
+
+def send_location_selection(chat_id, message_text='Please choose a location: 📍', extra_buttons=()):
+    outbox.send_message(chat_id, message_text, reply_markup=get_location_markup(extra_buttons))
 
-@bot.message_handler(commands=['start'])
-@log_command_decorator
+@handler(commands=['start'])
 def start(message):
-    bot.send_message(
+    outbox.send_message(
         message.chat.id,
         '🌤️ Welcome to ClimateNet! 🌧️'
     )
-    save_telegram_user(message.from_user)
-    bot.send_message(
-        message.chat.id,
-        f'''Hello {message.from_user.first_name}! 👋 I am your personal climate assistant. 
+    remember_user(message.from_user)
+    outbox.send_message(message.chat.id, get_intro_text(message.from_user.first_name))
+    send_location_selection(message.chat.id)
+
+def get_intro_text(first_name):
+    return f'''Hello {first_name}! 👋 I am your personal climate assistant. 
 With me, you can: 
     🔹 Access current measurements of temperature, humidity, wind speed, and more, refreshed every 15 minutes.
     🔹 Compare weather data between any two devices (e.g., TUMO in Yerevan vs. a device in Shirak).
 '''
-    )
-    send_location_selection(message.chat.id)
 
-@bot.message_handler(func=lambda message: message.text in locations.keys())
-@log_command_decorator
+@handler(func=lambda message: device_router.kind(message.text) == COUNTRY)
 def handle_country_selection(message):
     selected_country = message.text
     chat_id = message.chat.id
-    if chat_id not in user_context:
-        user_context[chat_id] = {}
-
-    if user_context[chat_id].get('comparing'):
-        if 'device1' not in user_context[chat_id]:
-            user_context[chat_id]['region1'] = selected_country
+    state = sessions.get(chat_id)
+    if state.comparing:
+        if state.comparison.device1 is None:
+            state.comparison.region1 = selected_country
         else:
-            user_context[chat_id]['region2'] = selected_country
+            state.comparison.region2 = selected_country
+    elif state.comparing_many is None:
+        state.selected_country = selected_country
+    sessions.save(chat_id, state)
+
+    markup = get_country_device_markup(selected_country, state)
+    outbox.send_message(chat_id, 'Please choose a device: ✅', reply_markup=markup)
+
+def get_country_device_markup(country, state):
+    comparing_many = state.comparing_many
+    if comparing_many is not None and len(comparing_many) >= MULTI_COMPARE_MIN:
+        mode = 'done'
+    elif state.comparison is not None:
+        mode = 'cancel'
     else:
-        user_context[chat_id]['selected_country'] = selected_country
+        mode = 'select'
+    return keyboard_cache.get(('devices', country, mode), lambda: build_country_device_markup(country, mode))
 
+def build_country_device_markup(country, mode):
     markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-    for device in locations[selected_country]:
+    for device in locations[country]:
         markup.add(types.KeyboardButton(device))
-    if user_context[chat_id].get('comparing'):
+    if mode == 'done':
+        markup.add(types.KeyboardButton('/Done ✅'), types.KeyboardButton('/Cancel'))
+    elif mode == 'cancel':
         markup.add(types.KeyboardButton('/Cancel'))
     else:
         markup.add(types.KeyboardButton('/Change_location'))
-    bot.send_message(chat_id, 'Please choose a device: ✅', reply_markup=markup)
-
-def uv_index(uv):
-    if uv is None:
-        return " "
-    if uv < 3:
-        return "Low 🟢"
-    elif 3 <= uv <= 5:
-        return "Moderate 🟡"
-    elif 6 <= uv <= 7:
-        return "High 🟠"
-    elif 8 <= uv <= 10:
-        return "Very High 🔴"
-    else:
-        return "Extreme 🟣"
-
-def pm_level(pm, pollutant):
-    if pm is None:
-        return "N/A"
-    thresholds = {
-        "PM1.0": [50, 100, 150, 200, 300],
-        "PM2.5": [12, 36, 56, 151, 251],
-        "PM10": [54, 154, 254, 354, 504]
-    }
-    levels = [
-        "Good 🟢",
-        "Moderate 🟡",
-        "Unhealthy for Sensitive Groups 🟠",
-        "Unhealthy 🟠",
-        "Very Unhealthy 🔴",
-        "Hazardous 🔴"
-    ]
-    thresholds = thresholds.get(pollutant, [])
-    for i, limit in enumerate(thresholds):
-        if pm <= limit:
-            return levels[i]
-    return levels[-1]
-
-import math
+    return markup
 
 def get_formatted_data(measurement, selected_device):
-    def safe_value(value, is_round=False):
-        if value is None or (isinstance(value, float) and math.isnan(value)):
-            return "NA"
-        return round(value) if is_round else value
-    
-    uv_description = uv_index(measurement.get('uv'))
-    pm1_description = pm_level(measurement.get('pm1'), "PM1.0")
-    pm2_5_description = pm_level(measurement.get('pm2_5'), "PM2.5")
-    pm10_description = pm_level(measurement.get('pm10'), "PM10")
-    
-    if selected_device in devices_with_issues:
+    if device_health.has_issues(device_ids.get(selected_device)):
         technical_issues_message = "\n⚠️ Note: At this moment this device has technical issues."
     else:
         technical_issues_message = ""
-
-    return (
-        f"<b>𝗟𝗮𝘁𝗲𝘀𝘁 𝗠𝗲𝗮𝘀𝘂𝗿𝗲𝗺𝗲𝗻𝘁</b>\n"
-        f"🔹 <b>Device:</b> <b>{selected_device}</b>\n"
-        f"🔹 <b>Timestamp:</b> {safe_value(measurement.get('timestamp'))}\n\n"
-        f"<b> 𝗟𝗶𝗴𝗵𝘁 𝗮𝗻𝗱 𝗨𝗩 𝗜𝗻𝗳𝗼𝗿𝗺𝗮𝘁𝗶𝗼𝗻</b>\n"
-        f"☀️ <b>UV Index:</b> {safe_value(measurement.get('uv'))} ({uv_description})\n"
-        f"🔆 <b>Light Intensity:</b> {safe_value(measurement.get('lux'))} lux\n\n"
-        f"<b> 𝗘𝗻𝘃𝗶𝗿𝗼𝗻𝗺𝗲𝗻𝘁𝗮𝗹 𝗖𝗼𝗻𝗱𝗶𝘁𝗶𝗼𝗻𝘀</b>\n"
-        f"🌡️ <b>Temperature:</b> {safe_value(measurement.get('temperature'), is_round=True)}°C\n"
-        f"⏲️ <b>Atmospheric Pressure:</b> {safe_value(measurement.get('pressure'))} hPa\n"
-        f"💧 <b>Humidity:</b> {safe_value(measurement.get('humidity'))}%\n\n"
-        f"<b> 𝗔𝗶𝗿 𝗤𝘂𝗮𝗹𝗶𝘁𝘆 𝗟𝗲𝘃𝗲𝗹𝘀</b>\n"
-        f"🫁 <b>PM1.0:</b> {safe_value(measurement.get('pm1'))} µg/m³  ({pm1_description})\n"
-        f"💨 <b>PM2.5:</b> {safe_value(measurement.get('pm2_5'))} µg/m³ ({pm2_5_description})\n"
-        f"🌫️ <b>PM10:</b> {safe_value(measurement.get('pm10'))} µg/m³ ({pm10_description})\n\n"
-        f"<b>𝗪𝗲𝗮𝘁𝗵𝗲𝗿 𝗖𝗼𝗻𝗱𝗶𝘁𝗶𝗼𝗻 </b>\n"
-        f"🌪️ <b>Wind Speed:</b> {safe_value(measurement.get('wind_speed'))} m/s\n"
-        f"🌧️ <b>Rainfall:</b> {safe_value(measurement.get('rain'))} mm\n"
-        f"🧭 <b>Wind Direction:</b> {safe_value(measurement.get('wind_direction'))}\n\n"
-        f"🔍 <b>Detected Weather Condition:</b> {detect_weather_condition(measurement, for_comparison=False)}\n"
-        f"{technical_issues_message}"
-    )
+    return renderer.render(selected_device, measurement) + technical_issues_message
 
 def format_comparison(device1, device1_data, device2, device2_data):
-    def safe_value(value, is_round=False):
-        if value is None or (isinstance(value, float) and math.isnan(value)):
-            return "N/A"
-        return round(value) if is_round else value
-
-    def compare_values(val1, val2, unit, desc, reverse=False):
-        if val1 == "N/A" or val2 == "N/A":
-            return f"{val1} {unit} vs {val2} {unit} (N/A)"
-        val1, val2 = float(val1), float(val2)
-        if val1 > val2:
-            return f"{val1} {unit} vs {val2} {unit} ({device1} is {desc})"
-        elif val2 > val1:
-            return f"{val1} {unit} vs {val2} {unit} ({device2} is {desc})"
-        else:
-            return f"{val1} {unit} vs {val2} {unit} (Equal)"
-
-    uv1 = safe_value(device1_data.get('uv'))
-    uv2 = safe_value(device2_data.get('uv'))
-    lux1 = safe_value(device1_data.get('lux'))
-    lux2 = safe_value(device2_data.get('lux'))
-    temp1 = safe_value(device1_data.get('temperature'), is_round=True)
-    temp2 = safe_value(device2_data.get('temperature'), is_round=True)
-    pressure1 = safe_value(device1_data.get('pressure'))
-    pressure2 = safe_value(device2_data.get('pressure'))
-    humidity1 = safe_value(device1_data.get('humidity'))
-    humidity2 = safe_value(device2_data.get('humidity'))
-    pm1_1 = safe_value(device1_data.get('pm1'))
-    pm1_2 = safe_value(device2_data.get('pm1'))
-    pm2_5_1 = safe_value(device2_data.get('pm2_5'))
-    pm2_5_2 = safe_value(device2_data.get('pm2_5'))
-    pm10_1 = safe_value(device1_data.get('pm10'))
-    pm10_2 = safe_value(device2_data.get('pm10'))
-    wind_speed1 = safe_value(device1_data.get('wind_speed'))
-    wind_speed2 = safe_value(device2_data.get('wind_speed'))
-    rain1 = safe_value(device1_data.get('rain'))
-    rain2 = safe_value(device2_data.get('rain'))
-    wind_dir1 = safe_value(device1_data.get('wind_direction'))
-    wind_dir2 = safe_value(device2_data.get('wind_direction'))
-
-    uv_desc1 = uv_index(device1_data.get('uv'))
-    uv_desc2 = uv_index(device2_data.get('uv'))
-    pm1_desc1 = pm_level(device1_data.get('pm1'), "PM1.0")
-    pm1_desc2 = pm_level(device2_data.get('pm1'), "PM1.0")
-    pm2_5_desc1 = pm_level(device1_data.get('pm2_5'), "PM2.5")
-    pm2_5_desc2 = pm_level(device2_data.get('pm2_5'), "PM2.5")
-    pm10_desc1 = pm_level(device1_data.get('pm10'), "PM10")
-    pm10_desc2 = pm_level(device2_data.get('pm10'), "PM10")
-
-    weather1 = detect_weather_condition(device1_data, for_comparison=True)
-    weather2 = detect_weather_condition(device2_data, for_comparison=True)
-    weather_line = f"🔍 <b>Detected Weather Condition:</b> {weather1} vs {weather2}\n" if weather1 or weather2 else ""
-
-    summary = []
-    if temp1 != "N/A" and temp2 != "N/A" and float(temp1) > float(temp2):
-        summary.append(f"{device1} is warmer")
-    elif temp2 != "N/A" and temp1 != "N/A" and float(temp2) > float(temp1):
-        summary.append(f"{device2} is warmer")
-    if uv1 != "N/A" and uv2 != "N/A" and float(uv1) > float(uv2):
-        summary.append(f"{device1} is sunnier")
-    elif uv2 != "N/A" and uv1 != "N/A" and float(uv2) > float(uv1):
-        summary.append(f"{device2} is sunnier")
-    if pm2_5_1 != "N/A" and pm2_5_2 != "N/A" and float(pm2_5_1) < float(pm2_5_2):
-        summary.append(f"{device1} has cleaner air")
-    elif pm2_5_2 != "N/A" and pm2_5_1 != "N/A" and float(pm2_5_2) < float(pm2_5_1):
-        summary.append(f"{device2} has cleaner air")
-    summary_text = f"🔹 <b>Summary:</b> {', '.join(summary) or 'Conditions are similar!'}\n"
-
-    return (
-        f"<b>𝗪𝗲𝗮𝘁𝗵𝗲𝗿 𝗖𝗼𝗺𝗽𝗮𝗿𝗶𝘀𝗼𝗻</b>\n"
-        f"🔹 <b>Devices:</b> <b>{device1}</b> vs <b>{device2}</b>\n"
-        f"🔹 <b>Timestamp:</b> {device1_data.get('timestamp')}\n\n"
-        f"<b> 𝗟𝗶𝗴𝗵𝘁 𝗮𝗻𝗱 𝗨𝗩 𝗜𝗻𝗳𝗼𝗿𝗺𝗮𝘁𝗶𝗼𝗻</b>\n"
-        f"☀️ <b>UV Index:</b> {compare_values(uv1, uv2, '', 'sunnier')} ({uv_desc1} vs {uv_desc2})\n"
-        f"🔆 <b>Light Intensity:</b> {compare_values(lux1, lux2, 'lux', 'brighter')}\n\n"
-        f"<b> 𝗘𝗻𝘃𝗶𝗿𝗼𝗻𝗺𝗲𝗻𝘁𝗮𝗹 𝗖𝗼𝗻𝗱𝗶𝘁𝗶𝗼𝗻𝘀</b>\n"
-        f"🌡️ <b>Temperature:</b> {compare_values(temp1, temp2, '°C', 'warmer')}\n"
-        f"⏲️ <b>Atmospheric Pressure:</b> {compare_values(pressure1, pressure2, 'hPa', 'higher')}\n"
-        f"💧 <b>Humidity:</b> {compare_values(humidity1, humidity2, '%', 'more humid')}\n\n"
-        f"<b> 𝗔𝗶𝗿 𝗤𝘂𝗮𝗹𝗶𝘁𝘆 𝗟𝗲𝘃𝗲𝗹𝘀</b>\n"
-        f"🫁 <b>PM1.0:</b> {compare_values(pm1_1, pm1_2, 'µg/m³', 'cleaner', reverse=True)} ({pm1_desc1} vs {pm1_desc2})\n"
-        f"💨 <b>PM2.5:</b> {compare_values(pm2_5_1, pm2_5_2, 'µg/m³', 'cleaner', reverse=True)} ({pm2_5_desc1} vs {pm2_5_desc2})\n"
-        f"🌫️ <b>PM10:</b> {compare_values(pm10_1, pm10_2, 'µg/m³', 'cleaner', reverse=True)} ({pm10_desc1} vs {pm10_desc2})\n\n"
-        f"<b>𝗪𝗲𝗮𝘁𝗵𝗲𝗿 𝗖𝗼𝗻𝗱𝗶𝘁𝗶𝗼𝗻</b>\n"
-        f"🌪️ <b>Wind Speed:</b> {compare_values(wind_speed1, wind_speed2, 'm/s', 'windier')}\n"
-        f"🌧️ <b>Rainfall:</b> {compare_values(rain1, rain2, 'mm', 'wetter')}\n"
-        f"🧭 <b>Wind Direction:</b> {wind_dir1} vs {wind_dir2}\n"
-        f"{weather_line}\n"
-        f"{summary_text}"
-    )
+    return renderer.render_comparison(device1, device1_data, device2, device2_data)
+
+def format_multi_comparison(devices):
+    return renderer.render_ranking(devices)
 
-@bot.message_handler(func=lambda message: message.text in [device for devices in locations.values() for device in devices])
-@log_command_decorator
+@handler(func=lambda message: device_router.kind(message.text) == DEVICE)
 def handle_device_selection(message):
     selected_device = message.text
     chat_id = message.chat.id
     device_id = device_ids.get(selected_device)
     
     if not device_id:
-        bot.send_message(chat_id, "⚠️ Device not found. ❌", reply_markup=get_command_menu())
+        outbox.send_message(chat_id, "⚠️ Device not found. ❌", reply_markup=get_command_menu())
         return
 
-    if chat_id not in user_context:
-        user_context[chat_id] = {'selected_country': None}
-
-    if user_context[chat_id].get('comparing'):
-        if 'device1' not in user_context[chat_id]:
-            user_context[chat_id]['device1'] = selected_device
-            user_context[chat_id]['device1_id'] = device_id
+    state = sessions.get(chat_id)
+    if state.comparing_many is not None:
+        yield from add_to_multi_comparison(chat_id, state, selected_device, device_id)
+    elif state.comparing:
+        if state.comparison.device1 is None:
+            state.comparison.device1 = selected_device
+            state.comparison.device1_id = device_id
+            sessions.save(chat_id, state)
             send_location_selection(chat_id, f"Selected {selected_device} as first device. Choose the location for the second device: 📍")
         else:
-            user_context[chat_id]['device2'] = selected_device
-            user_context[chat_id]['device2_id'] = device_id
-            compare_devices(chat_id)
-            user_context[chat_id].pop('comparing', None)
-            user_context[chat_id].pop('device1', None)
-            user_context[chat_id].pop('device1_id', None)
-            user_context[chat_id].pop('device2', None)
-            user_context[chat_id].pop('device2_id', None)
-            user_context[chat_id].pop('region1', None)
-            user_context[chat_id].pop('region2', None)
+            state.comparison.device2 = selected_device
+            state.comparison.device2_id = device_id
+            yield from compare_devices(chat_id, state)
+            state.reset_comparison()
+            sessions.save(chat_id, state)
     else:
-        user_context[chat_id]['selected_device'] = selected_device
-        user_context[chat_id]['device_id'] = device_id
-        save_selected_device_to_db(user_id=message.from_user.id, context=user_context[chat_id], device_id=device_id)
-        command_markup = get_command_menu(cur=selected_device)
-        measurement = fetch_latest_measurement(device_id)
-        if measurement:
-            formatted_data = get_formatted_data(measurement=measurement, selected_device=selected_device)
-            bot.send_message(chat_id, formatted_data, reply_markup=command_markup, parse_mode='HTML')
-            bot.send_message(chat_id, '''For the next measurement, select\t
-/Current 📍 every quarter of the hour. 🕒''')
-        else:
-            bot.send_message(chat_id, "⚠️ Error retrieving data. Please try again later.", reply_markup=command_markup)
+        state.selected_device = selected_device
+        state.device_id = device_id
+        sessions.save(chat_id, state)
+        write_buffer.submit(save_selected_device_to_db, user_id=message.from_user.id, context=state.as_dict(), device_id=device_id)
+        yield from send_measurement(chat_id, device_id, selected_device)
+
+def send_measurement(chat_id, device_id, selected_device):
+    command_markup = get_command_menu(cur=selected_device)
+    measurement, = yield [device_id]
+    if measurement:
+        formatted_data = get_formatted_data(measurement=measurement, selected_device=selected_device)
+        formatted_data += get_staleness_note(device_id)
+        outbox.send_message(chat_id, formatted_data, reply_markup=command_markup, parse_mode='HTML')
+        outbox.send_message(chat_id, NEXT_MEASUREMENT_TEXT)
+    else:
+        outbox.send_message(chat_id, "⚠️ Error retrieving data. Please try again later.", reply_markup=command_markup)
 
 def get_command_menu(cur=None):
     if cur is None:
         cur = ""
+    return keyboard_cache.get(('menu', cur), lambda: build_command_menu(cur))
+
+def build_command_menu(cur):
     command_markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
     command_markup.add(
         types.KeyboardButton(f'/Current 📍{cur}'),
         types.KeyboardButton('/Compare 🔍'),
+        types.KeyboardButton('/Compare_many 📊'),
+        types.KeyboardButton('/History 📈'),
+        types.KeyboardButton('/Alerts 🔔'),
+        types.KeyboardButton('/Ranking 🏆'),
+        types.KeyboardButton('/Overview 📋'),
         types.KeyboardButton('/Change_device 🔄'),
         types.KeyboardButton('/Help ❓'),
         types.KeyboardButton('/Website 🌐'),
@@ -361,224 +580,363 @@ def get_command_menu(cur=None):
     return command_markup
 
 def get_device_selection_markup(country):
-    markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-    for device in locations[country]:
-        markup.add(types.KeyboardButton(device))
-    markup.add(types.KeyboardButton('/Cancel'))
-    return markup
+    return keyboard_cache.get(('devices', country, 'cancel'), lambda: build_country_device_markup(country, 'cancel'))
 
-@bot.message_handler(commands=['Compare'])
-@log_command_decorator
+@handler(commands=['Compare'])
 def start_comparison(message):
     chat_id = message.chat.id
-    if chat_id not in user_context:
-        user_context[chat_id] = {}
-    user_context[chat_id]['comparing'] = True
-    user_context[chat_id].pop('device1', None)
-    user_context[chat_id].pop('device1_id', None)
-    user_context[chat_id].pop('device2', None)
-    user_context[chat_id].pop('device2_id', None)
-    user_context[chat_id].pop('region1', None)
-    user_context[chat_id].pop('region2', None)
+    state = sessions.get(chat_id)
+    state.start_comparison()
+    sessions.save(chat_id, state)
     send_location_selection(chat_id, 'Choose the location for the first device to compare: 📍')
 
-def compare_devices(chat_id):
-    device1 = user_context[chat_id]['device1']
-    device1_id = user_context[chat_id]['device1_id']
-    device2 = user_context[chat_id]['device2']
-    device2_id = user_context[chat_id]['device2_id']
+def compare_devices(chat_id, state):
+    device1 = state.comparison.device1
+    device1_id = state.comparison.device1_id
+    device2 = state.comparison.device2
+    device2_id = state.comparison.device2_id
     
-    measurement1 = fetch_latest_measurement(device1_id)
-    measurement2 = fetch_latest_measurement(device2_id)
+    measurement1, measurement2 = yield [device1_id, device2_id]
     
     command_markup = get_command_menu()
     if measurement1 and measurement2:
         comparison_data = format_comparison(device1, measurement1, device2, measurement2)
-        bot.send_message(chat_id, comparison_data, reply_markup=command_markup, parse_mode='HTML')
+        comparison_data += get_staleness_note(device1_id, device1) + get_staleness_note(device2_id, device2)
+        outbox.send_message(chat_id, comparison_data, reply_markup=command_markup, parse_mode='HTML')
     else:
-        bot.send_message(chat_id, "⚠️ Error retrieving data for one or both devices. Please try again.", reply_markup=command_markup)
+        outbox.send_message(chat_id, "⚠️ Error retrieving data for one or both devices. Please try again.", reply_markup=command_markup)
 
-@bot.message_handler(commands=['Cancel'])
-@log_command_decorator
+@handler(commands=['Compare_many'])
+def start_multi_comparison(message):
+    chat_id = message.chat.id
+    state = sessions.get(chat_id)
+    state.start_multi_comparison()
+    sessions.save(chat_id, state)
+    send_location_selection(
+        chat_id,
+        f'Choose {MULTI_COMPARE_MIN} to {MULTI_COMPARE_MAX} devices to compare, one at a time. Location of the first device: 📍',
+        extra_buttons=['/Cancel']
+    )
+
+def add_to_multi_comparison(chat_id, state, selected_device, device_id):
+    selected = state.comparing_many
+    if all(name != selected_device for name, _ in selected):
+        selected.append((selected_device, device_id))
+    if len(selected) >= MULTI_COMPARE_MAX:
+        yield from compare_many_devices(chat_id, state)
+        return
+    sessions.save(chat_id, state)
+    extra_buttons = ['/Done ✅', '/Cancel'] if len(selected) >= MULTI_COMPARE_MIN else ['/Cancel']
+    send_location_selection(
+        chat_id,
+        f"Selected {selected_device} ({len(selected)}/{MULTI_COMPARE_MAX}). Choose the location for the next device: 📍",
+        extra_buttons=extra_buttons
+    )
+
+@handler(commands=['Done'])
+def finish_multi_comparison(message):
+    chat_id = message.chat.id
+    state = sessions.peek(chat_id)
+    selected = state.comparing_many if state is not None else None
+    if selected is None:
+        outbox.send_message(chat_id, "⚠️ Start a comparison first using /Compare_many 📊.", reply_markup=get_command_menu())
+    elif len(selected) < MULTI_COMPARE_MIN:
+        outbox.send_message(chat_id, f"⚠️ Please select at least {MULTI_COMPARE_MIN} devices to compare.")
+    else:
+        yield from compare_many_devices(chat_id, state)
+
+def compare_many_devices(chat_id, state):
+    selected = state.comparing_many
+    state.reset_comparison()
+    sessions.save(chat_id, state)
+    measurements = yield [device_id for _, device_id in selected]
+    devices = [(name, measurement) for (name, _), measurement in zip(selected, measurements)]
+
+    command_markup = get_command_menu()
+    if sum(1 for _, measurement in devices if measurement) >= 2:
+        outbox.send_message(chat_id, format_multi_comparison(devices), reply_markup=command_markup, parse_mode='HTML')
+    else:
+        outbox.send_message(chat_id, "⚠️ Error retrieving data for the selected devices. Please try again.", reply_markup=command_markup)
+
+@handler(commands=['Cancel'])
 def cancel_comparison(message):
     chat_id = message.chat.id
-    if chat_id in user_context:
-        user_context[chat_id].pop('comparing', None)
-        user_context[chat_id].pop('device1', None)
-        user_context[chat_id].pop('device1_id', None)
-        user_context[chat_id].pop('device2', None)
-        user_context[chat_id].pop('device2_id', None)
-        user_context[chat_id].pop('region1', None)
-        user_context[chat_id].pop('region2', None)
-    bot.send_message(chat_id, "Comparison canceled. Back to main menu.", reply_markup=get_command_menu())
-
-@bot.message_handler(commands=['Current'])
-@log_command_decorator
+    state = sessions.peek(chat_id)
+    if state is not None:
+        state.reset_comparison()
+        sessions.save(chat_id, state)
+    outbox.send_message(chat_id, "Comparison canceled. Back to main menu.", reply_markup=get_command_menu())
+
+@handler(commands=['Current'])
 def get_current_data(message):
     chat_id = message.chat.id
-    command_markup = get_command_menu()
-    save_telegram_user(message.from_user)
-    if chat_id in user_context and 'device_id' in user_context[chat_id]:
-        device_id = user_context[chat_id]['device_id']
-        selected_device = user_context[chat_id].get('selected_device')
-        command_markup = get_command_menu(cur=selected_device)
-        measurement = fetch_latest_measurement(device_id)
-        if measurement:
-            formatted_data = get_formatted_data(measurement=measurement, selected_device=selected_device)
-            bot.send_message(chat_id, formatted_data, reply_markup=command_markup, parse_mode='HTML')
-            bot.send_message(chat_id, '''For the next measurement, select\t
-/Current 📍 every quarter of the hour. 🕒''')
-        else:
-            bot.send_message(chat_id, "⚠️ Error retrieving data. Please try again later.", reply_markup=command_markup)
+    remember_user(message.from_user)
+    state = sessions.peek(chat_id)
+    if state is not None and state.device_id is not None:
+        yield from send_measurement(chat_id, state.device_id, state.selected_device)
+    else:
+        outbox.send_message(chat_id, "⚠️ Please select a device first using /Change_device 🔄.", reply_markup=get_command_menu())
+
+@handler(commands=list(HISTORY_PERIODS))
+def get_history(message):
+    chat_id = message.chat.id
+    state = sessions.peek(chat_id)
+    if state is None or state.device_id is None:
+        outbox.send_message(chat_id, "⚠️ Please select a device first using /Change_device 🔄.", reply_markup=get_command_menu())
+        return
+    text = get_history_text(state.selected_device, state.device_id, util.extract_command(message.text))
+    outbox.send_message(chat_id, text, reply_markup=get_command_menu(cur=state.selected_device), parse_mode='HTML')
+
+def get_history_text(selected_device, device_id, command):
+    period, span, buckets = HISTORY_PERIODS.get(command, HISTORY_PERIODS['History'])
+    until = history_store.latest_time(device_id)
+    if until is None:
+        return f"⚠️ No history has been recorded for {selected_device} yet. Check back after the next measurement."
+    _, summary = history_store.downsample(device_id, until - span, until, buckets)
+    text = renderer.render_history(selected_device, period, from_epoch(until), summary)
+    if command == 'History':
+        text += "\nSee /History_7d for the last week."
+    return text
+
+@handler(commands=['Ranking', *RANKING_COMMANDS])
+def show_ranking(message):
+    chat_id = message.chat.id
+    state = sessions.peek(chat_id)
+    cur = state.selected_device if state is not None else None
+    text = leaderboard.ranking_text(util.extract_command(message.text))
+    outbox.send_message(chat_id, text, reply_markup=get_command_menu(cur=cur), parse_mode='HTML')
+
+@handler(commands=['Overview'])
+def show_overview(message):
+    chat_id = message.chat.id
+    state = sessions.peek(chat_id)
+    cur = state.selected_device if state is not None else None
+    outbox.send_message(chat_id, leaderboard.overview_text(), reply_markup=get_command_menu(cur=cur), parse_mode='HTML')
+
+@handler(commands=['Alerts'])
+def list_alerts(message):
+    chat_id = message.chat.id
+    state = sessions.peek(chat_id)
+    cur = state.selected_device if state is not None else None
+    outbox.send_message(chat_id, get_alerts_text(chat_id, state), reply_markup=get_command_menu(cur=cur), parse_mode='HTML')
+
+@handler(commands=list(ALERT_COMMANDS))
+def toggle_alert(message):
+    chat_id = message.chat.id
+    state = sessions.peek(chat_id)
+    if state is None or state.device_id is None:
+        outbox.send_message(chat_id, "⚠️ Please select a device first using /Change_device 🔄.", reply_markup=get_command_menu())
+        return
+    outbox.send_message(chat_id, get_alert_toggle_text(chat_id, state, util.extract_command(message.text)), parse_mode='HTML')
+
+def get_alert_toggle_text(chat_id, state, command):
+    rule = ALERT_COMMANDS[command]
+    if not alert_subscriptions.toggle(chat_id, state.device_id, rule.key):
+        return f"🔕 Alert removed: {rule.description} at <b>{escape(state.selected_device)}</b>."
+    text = f"🔔 Alert added: {rule.description} at <b>{escape(state.selected_device)}</b>."
+    band = alert_engine.band(state.device_id, rule.key)
+    if band is not None:
+        text += f"\nRight now: {band}"
+    return text
+
+def get_alerts_text(chat_id, state):
+    subscriptions = alert_subscriptions.for_chat(chat_id)
+    lines = ["<b>𝗔𝗹𝗲𝗿𝘁𝘀</b>"]
+    if subscriptions:
+        lines += [f"🔔 {escape(device_names.get(device_id, device_id))}: {ALERT_RULES[key].description}"
+                  for device_id, key in subscriptions if key in ALERT_RULES]
     else:
-        bot.send_message(chat_id, "⚠️ Please select a device first using /Change_device 🔄.", reply_markup=command_markup)
+        lines.append("You have no alerts yet.")
+    if state is not None and state.device_id is not None:
+        lines.append(f"\nTurn alerts for <b>{escape(state.selected_device)}</b> on or off:")
+        for rule in ALERT_RULES.values():
+            mark = "✅" if alert_subscriptions.subscribed(chat_id, state.device_id, rule.key) else "▫️"
+            lines.append(f"{mark} /{rule.command} {rule.description}")
+    else:
+        lines.append("\nSelect a device with /Change_device 🔄 to add alerts.")
+    return "\n".join(lines)
 
-@bot.message_handler(commands=['Help'])
-@log_command_decorator
+@handler(commands=['Help'])
 def help(message):
-    bot.send_message(message.chat.id, '''
-<b>/Current 📍:</b> Get the latest climate data in selected location.\n
-<b>/Compare 🔍:</b> Compare weather data between two devices.\n
-<b>/Change_device 🔄:</b> Change to another climate monitoring device.\n
-<b>/Help ❓:</b> Show available commands.\n
-<b>/Website 🌐:</b> Visit our website for more information.\n
-<b>/Map 🗺️:</b> View the locations of all devices on a map.\n
-<b>/Share_location 🌍:</b> Share your location.\n
-''', parse_mode='HTML')
+    outbox.send_message(message.chat.id, HELP_TEXT, parse_mode='HTML')
 
-@bot.message_handler(commands=['Change_device'])
-@log_command_decorator
+@handler(commands=['Change_device'])
 def change_device(message):
     chat_id = message.chat.id
-    if chat_id in user_context:
-        user_context[chat_id].pop('selected_device', None)
-        user_context[chat_id].pop('device_id', None)
-        user_context[chat_id].pop('comparing', None)
-        user_context[chat_id].pop('device1', None)
-        user_context[chat_id].pop('device1_id', None)
-        user_context[chat_id].pop('device2', None)
-        user_context[chat_id].pop('device2_id', None)
-        user_context[chat_id].pop('region1', None)
-        user_context[chat_id].pop('region2', None)
+    state = sessions.peek(chat_id)
+    if state is not None:
+        state.reset_device()
+        state.reset_comparison()
+        sessions.save(chat_id, state)
     send_location_selection(chat_id)
 
-@bot.message_handler(commands=['Change_location'])
-@log_command_decorator
+@handler(commands=['Change_location'])
 def change_location(message):
     chat_id = message.chat.id
-    if chat_id in user_context:
-        user_context[chat_id].pop('comparing', None)
-        user_context[chat_id].pop('device1', None)
-        user_context[chat_id].pop('device1_id', None)
-        user_context[chat_id].pop('device2', None)
-        user_context[chat_id].pop('device2_id', None)
-        user_context[chat_id].pop('region1', None)
-        user_context[chat_id].pop('region2', None)
+    state = sessions.peek(chat_id)
+    if state is not None:
+        state.reset_comparison()
+        sessions.save(chat_id, state)
     send_location_selection(chat_id)
 
-@bot.message_handler(commands=['Website'])
-@log_command_decorator
+@handler(commands=['Website'])
 def website(message):
-    markup = types.InlineKeyboardMarkup()
-    button = types.InlineKeyboardButton('Visit Website', url='https://climatenet.am/en/')
-    markup.add(button)
-    bot.send_message(
+    outbox.send_message(
         message.chat.id,
         'For more information, click the button below to visit our official website: 🖥️',
-        reply_markup=markup
+        reply_markup=get_website_markup()
     )
 
-@bot.message_handler(commands=['Map'])
-@log_command_decorator
+def get_website_markup():
+    return keyboard_cache.get(('website',), build_website_markup)
+
+def build_website_markup():
+    markup = types.InlineKeyboardMarkup()
+    button = types.InlineKeyboardButton('Visit Website', url='https://climatenet.am/en/')
+    markup.add(button)
+    return markup
+
+@handler(commands=['Map'])
 def map(message):
     chat_id = message.chat.id
-    image = 'https://images-in-website.s3.us-east-1.amazonaws.com/Bot/map.png'
-    bot.send_message(chat_id, 
+    outbox.send_message(chat_id, 
 '''📌 The highlighted locations indicate the current active climate devices. 🗺️ ''')
-    bot.send_photo(chat_id, photo=image)
+    outbox.send_photo(chat_id, MAP_IMAGE_URL)
 
-@bot.message_handler(content_types=['audio', 'document', 'photo', 'sticker', 'video', 'video_note', 'voice', 'contact', 'venue', 'animation'])
-@log_command_decorator
+@handler(content_types=['audio', 'document', 'photo', 'sticker', 'video', 'video_note', 'voice', 'contact', 'venue', 'animation'])
 def handle_media(message):
-    bot.send_message(
-        message.chat.id,
-        '''❗ Please use a valid command.
-You can see all available commands by typing /Help❓
-''')
+    outbox.send_message(message.chat.id, INVALID_COMMAND_TEXT)
 
-@bot.message_handler(func=lambda message: not message.text.startswith('/'))
-@log_command_decorator
+@handler(func=lambda message: not message.text.startswith('/'))
 def handle_text(message):
-    bot.send_message(
-        message.chat.id,
-        '''❗ Please use a valid command.
-You can see all available commands by typing /Help❓
-''')
+    outbox.send_message(message.chat.id, INVALID_COMMAND_TEXT)
 
-@bot.message_handler(commands=['Share_location'])
-@log_command_decorator
+@handler(commands=['Share_location'])
 def request_location(message):
+    outbox.send_message(
+        message.chat.id,
+        "Click the button below to share your location 🔽",
+        reply_markup=get_share_location_markup()
+    )
+
+def get_share_location_markup():
+    return keyboard_cache.get(('share_location',), build_share_location_markup)
+
+def build_share_location_markup():
     location_button = types.KeyboardButton("📍 Share Location", request_location=True)
     markup = types.ReplyKeyboardMarkup(row_width=1, resize_keyboard=True, one_time_keyboard=True)
     back_to_menu_button = types.KeyboardButton("/back 🔙")
     markup.add(location_button, back_to_menu_button)
-    bot.send_message(
-        message.chat.id,
-        "Click the button below to share your location 🔽",
-        reply_markup=markup
-    )
+    return markup
+
+def get_nearby_stations(latitude, longitude):
+    current_ids = device_ids
+    stations = [station for station in station_index.nearest(latitude, longitude, k=NEARBY_STATIONS) if station[0] in current_ids]
+    measurements = yield [current_ids[name] for name, _ in stations]
+    return [(name, distance, measurement) for (name, distance), measurement in zip(stations, measurements)]
+
+def get_nearby_markup(names):
+    return keyboard_cache.get(('nearby', names), lambda: build_nearby_markup(names))
+
+def build_nearby_markup(names):
+    markup = types.ReplyKeyboardMarkup(row_width=1, resize_keyboard=True, one_time_keyboard=True)
+    markup.add(*(types.KeyboardButton(name) for name in names), types.KeyboardButton("/back 🔙"))
+    return markup
 
-@bot.message_handler(commands=['back'])
-@log_command_decorator
+@handler(commands=['back'])
 def go_back_to_menu(message):
-    bot.send_message(
+    outbox.send_message(
         message.chat.id,
         "You are back to the main menu. How can I assist you?",
         reply_markup=get_command_menu()
     )
 
-@bot.message_handler(content_types=['location'])
-@log_command_decorator
+@handler(content_types=['location'])
 def handle_location(message):
     user_location = message.location
     if user_location:
         latitude = user_location.latitude
         longitude = user_location.longitude
         res = f"{longitude},{latitude}"
-        save_users_locations(from_user=message.from_user.id, location=res)
-        command_markup = get_command_menu()
-        bot.send_message(
-            message.chat.id,
-            "Select other commands to continue ▶️",
-            reply_markup=command_markup
-        )
+        write_buffer.submit(save_users_locations, from_user=message.from_user.id, location=res)
+        nearby = yield from get_nearby_stations(latitude, longitude)
+        if nearby:
+            outbox.send_message(
+                message.chat.id,
+                renderer.render_nearby(nearby) + "\nTap a station to select it.",
+                reply_markup=get_nearby_markup(tuple(name for name, _, _ in nearby)),
+                parse_mode='HTML'
+            )
+        else:
+            command_markup = get_command_menu()
+            outbox.send_message(
+                message.chat.id,
+                "Select other commands to continue ▶️",
+                reply_markup=command_markup
+            )
     else:
-        bot.send_message(
+        outbox.send_message(
             message.chat.id,
             "Failed to get your location. Please try again."
         )
 
-def detect_weather_condition(measurement, for_comparison=False):
-    temperature = measurement.get("temperature")
-    humidity = measurement.get("humidity")
-    lux = measurement.get("lux")
-    pm2_5 = measurement.get("pm2_5")
-    uv = measurement.get("uv")
-    wind_speed = measurement.get("wind_speed")
-    if temperature is not None and temperature < 1 and humidity and humidity > 85:
-        return "Possibly Snowing ❄️"
-    elif lux is not None and lux < 100 and humidity and humidity > 90 and pm2_5 and pm2_5 > 40:
-        return "Foggy 🌫️"
-    elif lux and lux < 300 and uv and uv < 2:
-        return "Cloudy ☁️"
-    elif lux and lux > 5 and uv and uv > 3:
-        return "Sunny ☀️"
-    else:
-        return "" if for_comparison else "Nothing detected ❌"
+@bot.inline_handler(func=lambda query: True)
+def handle_inline_query(query):
+    # Not logged as a command: inline queries arrive on every keystroke and have no chat.
+    with metrics.track('handle_inline_query'):
+        bot.answer_inline_query(query.id, get_inline_results(query.query), cache_time=INLINE_CACHE_SECONDS)
+
+def get_inline_results(text):
+    # Served from the catalog and the snapshot only; a keystroke never reaches upstream.
+    results = []
+    for position, match in enumerate(search_index.search(text, INLINE_RESULTS)):
+        if match.kind == DEVICE:
+            entry = measurement_snapshot.get(match.device_id)
+            description = renderer.render_compact(match.name, entry.measurement) if entry else "No recent data"
+        else:
+            description = f"Region, {len(locations.get(match.name, ()))} stations"
+        results.append(types.InlineQueryResultArticle(
+            id=str(position),
+            title=match.name,
+            description=description,
+            input_message_content=types.InputTextMessageContent(match.name),
+        ))
+    return results
 
 if __name__ == "__main__":
     start_bot_thread()
 
 def run_bot_view(request):
+    started = start_bot_thread()
+    status = 'Bot is running in the background!' if started else 'Bot is already running.'
+    return JsonResponse({'status': status, 'mode': BOT_MODE, 'engine': BOT_ENGINE})
+
+def metrics_view(request):
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not METRICS_TOKEN or not hmac.compare_digest(token, METRICS_TOKEN):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    if request.GET.get('format') == 'prometheus':
+        return HttpResponse(metrics.as_prometheus(), content_type='text/plain; version=0.0.4')
+    return JsonResponse(metrics.as_dict())
+
+@csrf_exempt
+def telegram_webhook_view(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    # The async engine and the polling and sharded modes fetch updates themselves.
+    if BOT_MODE != 'webhook' or BOT_ENGINE != 'sync':
+        return JsonResponse({'error': 'Webhook is not enabled'}, status=404)
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not TELEGRAM_WEBHOOK_SECRET or not hmac.compare_digest(secret, TELEGRAM_WEBHOOK_SECRET):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    try:
+        update = types.Update.de_json(request.body.decode('utf-8'))
+    except (ValueError, KeyError, TypeError):
+        update = None
+    if update is None:
+        return JsonResponse({'error': 'Invalid update'}, status=400)
     start_bot_thread()
-    return JsonResponse({'status': 'Bot is running in the background!'})
+    if not update_pool.submit(update):
+        # Telegram redelivers on non-2xx responses, which gives us backpressure for free.
+        return JsonResponse({'status': 'busy'}, status=503)
+    return JsonResponse({'status': 'ok'})
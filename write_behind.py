@@ -0,0 +1,161 @@
+import os
+import threading
+from collections import OrderedDict
+
+from django.db import DatabaseError, close_old_connections, transaction
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WRITE_BEHIND_BATCH = int(os.getenv('WRITE_BEHIND_BATCH', '200'))
+WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', '1.0'))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '20000'))
+KNOWN_USERS_MAX = int(os.getenv('KNOWN_USERS_MAX', '100000'))
+
+USER_FIELDS = ('username', 'first_name', 'last_name', 'language_code', 'is_premium')
+
+
+class KnownUsers:
+    # Profiles the database already has, so unchanged users are not written again.
+    def __init__(self, max_size=KNOWN_USERS_MAX):
+        self.max_size = max_size
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def changed(self, user):
+        profile = tuple(getattr(user, name, None) for name in USER_FIELDS)
+        with self._lock:
+            if self._profiles.get(user.id) == profile:
+                self._profiles.move_to_end(user.id)
+                return False
+            self._profiles[user.id] = profile
+            self._profiles.move_to_end(user.id)
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+            return True
+
+    def forget(self, user_id):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+
+
+class WriteBehindBuffer:
+    # Handlers hand their writes over and reply straight away. A writer thread
+    # runs them in batches, by size or every interval, inside one transaction
+    # per batch; each write gets a savepoint so one failure does not lose the
+    # rest. Writes submitted with a key replace a pending write with the same
+    # function and key. on_error is called when the write fails; once the
+    # buffer is closed, submit() refuses writes instead of holding them.
+    def __init__(self, batch_size=WRITE_BEHIND_BATCH, interval=WRITE_BEHIND_INTERVAL,
+                 max_pending=WRITE_BEHIND_MAX_PENDING):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.batches = 0
+        self._pending = OrderedDict()
+        self._sequence = 0
+        self._thread = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None or self._closed:
+                return False
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+            return True
+
+    def submit(self, function, *args, key=None, on_error=None, **kwargs):
+        self.start()
+        with self._condition:
+            if self._closed:
+                self.dropped += 1
+                return False
+            if key is not None and (function, key) in self._pending:
+                self._pending[(function, key)] = (function, args, kwargs, on_error)
+                self.coalesced += 1
+                return True
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            if key is None:
+                self._sequence += 1
+                key = self._sequence
+            self._pending[(function, key)] = (function, args, kwargs, on_error)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+            return True
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._condition.wait(self.interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        # Also called on shutdown; the lock keeps batches in submission order.
+        with self._flush_lock:
+            with self._condition:
+                batch = list(self._pending.values())
+                self._pending.clear()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        written, failures = 0, []
+        try:
+            with transaction.atomic():
+                for write in batch:
+                    function, args, kwargs, _ = write
+                    try:
+                        with transaction.atomic():
+                            function(*args, **kwargs)
+                        written += 1
+                    except Exception as e:
+                        failures.append(write)
+                        print(f"Error in buffered write {function.__name__}: {e}")
+        except DatabaseError as e:
+            written, failures = 0, batch
+            print(f"Error flushing {len(batch)} buffered writes: {e}")
+        finally:
+            close_old_connections()
+        for _, _, _, on_error in failures:
+            if on_error is not None:
+                on_error()
+        failed = len(failures)
+        with self._condition:
+            self.written += written
+            self.failed += failed
+            self.batches += 1
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'written': self.written,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'batches': self.batches,
+            }